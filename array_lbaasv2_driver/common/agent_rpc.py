@@ -12,6 +12,11 @@
 # limitations under the License.
 #
 
+import collections
+import re
+import threading
+
+from oslo_config import cfg
 from oslo_log import helpers as log_helpers
 from oslo_log import log as logging
 import oslo_messaging as messaging
@@ -19,12 +24,157 @@ import oslo_messaging as messaging
 from neutron.common import rpc
 from neutron_lbaas.services.loadbalancer import data_models
 
+from array_lbaasv2_driver.common import cache
 from array_lbaasv2_driver.common import constants_v2
+from array_lbaasv2_driver.common import digest
+from array_lbaasv2_driver.common import exceptions as array_exc
+from array_lbaasv2_driver.common import outbox
+from array_lbaasv2_driver.common import utils
+from array_lbaasv2_driver.common import workers
 
 LOG = logging.getLogger(__name__)
 
+AGENT_RPC_OPTS = [
+    cfg.IntOpt(
+        'array_rpc_coalesce_window',
+        default=0,
+        help=('Window in milliseconds during which casts to the agent are '
+              'buffered so that successive operations on the same object '
+              'are collapsed into one message. 0 disables coalescing. '
+              'The neutron-lbaas plugin keeps the loadbalancer in '
+              'PENDING_UPDATE until the agent reports on an operation '
+              'and refuses others meanwhile, so with it casts are only '
+              'delayed, never merged or cancelled. Leave it at 0 unless '
+              'the plugin does not lock the loadbalancer')
+    ),
+    cfg.IntOpt(
+        'array_rpc_client_cache_size',
+        default=64,
+        help=('Number of prepared RPC clients, one per distinct set of '
+              'topic/server/fanout/version/timeout/namespace options, '
+              'kept for reuse across casts')
+    ),
+    cfg.StrOpt(
+        'array_agent_rpc_version_cap',
+        default=constants_v2.BASE_RPC_API_VERSION,
+        help=('Highest RPC API version the agents are known to support. '
+              'Set it to 1.1 once all agents accept delta encoded '
+              'update_* casts, 1.2 once they support digest based '
+              'loadbalancer refresh, 1.3 once they accept cascade '
+              'deletes, 1.4 once they accept L7 policies with their '
+              'rules and batched rule changes')
+    ),
+    cfg.DictOpt(
+        'array_rpc_field_projections',
+        default={},
+        help=('Per RPC method list of the top level fields the agent '
+              'consumes, e.g. update_loadbalancer_stats:id|vip_address. '
+              'Data model attributes outside the projection are not '
+              'serialized. Methods not listed carry the full object')
+    ),
+    cfg.BoolOpt(
+        'array_rpc_host_routing',
+        default=False,
+        help=('Send casts to the agent hosting the loadbalancer '
+              '(server=host) instead of the shared agent topic. When the '
+              'host is unknown the agent is picked by consistent hashing '
+              'of the loadbalancer id over the live agents. Agents must '
+              'consume their host specific topic')
+    ),
+    cfg.IntOpt(
+        'array_rpc_dispatch_workers',
+        default=0,
+        help=('Number of workers sending casts in the background, so API '
+              'requests return once the cast is queued. Casts of one '
+              'loadbalancer are sent in order by the same worker. 0 '
+              'sends them in the API request')
+    ),
+    cfg.IntOpt(
+        'array_rpc_dispatch_queue_size',
+        default=1000,
+        help=('Maximum number of casts queued per dispatch worker')
+    ),
+    cfg.StrOpt(
+        'array_rpc_dispatch_full_policy',
+        default='degrade',
+        choices=['reject', 'degrade'],
+        help=('What to do with a cast whose dispatch queue is full: '
+              'reject fails the API request, degrade holds the API '
+              'request until the queue has room, which keeps the casts '
+              'of a loadbalancer in order')
+    ),
+    cfg.IntOpt(
+        'array_rpc_dispatch_starvation_limit',
+        default=8,
+        help=('Number of times queued casts of a priority class may be '
+              'passed over by casts of higher classes before one of '
+              'them is sent. Deletes, admin state and health monitor '
+              'changes are sent first, bulk creates and refreshes last')
+    ),
+    cfg.IntOpt(
+        'array_l7rule_batch_window',
+        default=0,
+        help=('Window in milliseconds during which the L7 rule changes '
+              'of a policy are collected and sent as one cast. Requires '
+              'array_agent_rpc_version_cap 1.4. 0 sends one cast per '
+              'rule change. The neutron-lbaas plugin keeps the '
+              'loadbalancer in PENDING_UPDATE until the agent reports '
+              'on a change and refuses others meanwhile, so a batch '
+              'only ever holds more than one change with a plugin that '
+              'does not lock the loadbalancer')
+    )
+]
+
+cfg.CONF.register_opts(AGENT_RPC_OPTS, "arraynetworks")
+
+# bulk work that yields to everything else in the dispatch queue
+_LOW_PRIORITY_METHODS = frozenset(['create_members', 'refresh_loadbalancer'])
+
+
+def _field(obj, name):
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _cast_priority(msg):
+    """Priority class of a cast in the dispatch queue."""
+
+    method = msg['method']
+    args = msg['args']
+    if method.startswith('delete_') or method.endswith('_health_monitor'):
+        return workers.PRIORITY_HIGH
+    if 'old_obj' in args and (_field(args['old_obj'], 'admin_state_up') !=
+                              _field(args['obj'], 'admin_state_up')):
+        return workers.PRIORITY_HIGH
+    if method in _LOW_PRIORITY_METHODS:
+        return workers.PRIORITY_LOW
+    return workers.PRIORITY_NORMAL
+
+
+_COALESCE_METHOD = re.compile(
+    r'^(create|update|delete)_(loadbalancer|listener|pool|member|'
+    r'health_monitor|l7policy|l7rule)$')
+
+# completion object types of the objects named in cast methods
+_COMPLETION_OBJ_TYPES = {'health_monitor': 'hm'}
+
+_L7RULE_METHOD = re.compile(r'^(create|update|delete)_l7rule$')
+
 
 class DataModelSerializer(object):
+    """Serialize neutron-lbaas data models for the agent.
+
+    serialize_message() converts all arguments of one message at once. A
+    row reached more than once in an argument, at any depth (a pool is
+    reached both as a listener's default pool and through
+    loadbalancer.pools), is serialized only once per distinct content.
+    When a projection is configured for the RPC method the pruned
+    attributes are never walked.
+    """
+
+    def __init__(self, projections=None):
+        self.projections = projections or {}
 
     def serialize_entity(self, ctx, entity):
         if isinstance(entity, data_models.BaseDataModel):
@@ -32,6 +182,300 @@ class DataModelSerializer(object):
         else:
             return entity
 
+    def serialize_message(self, method, args):
+        fields = self.projections.get(method)
+        # old_obj and obj are two states of the same rows, each argument
+        # gets a memo of its own
+        return dict((name, self._serialize(value, fields, {}))
+                    for name, value in args.items())
+
+    def _serialize(self, value, fields, memo):
+        if isinstance(value, data_models.BaseDataModel):
+            return self.to_dict(value, fields, memo)
+        if isinstance(value, (list, tuple)):
+            return [self._serialize(item, fields, memo) for item in value]
+        return value
+
+    @classmethod
+    def to_dict(cls, entity, fields=None, memo=None):
+        """Serialize a data model, restricted to fields when given.
+
+        The result is the one of entity.to_dict(stats=False), but nested
+        data models are serialized through memo, so each of them is
+        walked once however often it is reached.
+        """
+        if memo is None:
+            memo = {}
+        key = (id(entity), 'top')
+        if key not in memo:
+            excluded = lambda attr: (attr == 'stats' or
+                                     fields and attr not in fields)
+            memo[key] = cls._model_dict(entity, excluded, memo, ())
+        return memo[key]
+
+    @staticmethod
+    def _ancestry(calling):
+        """What from_sqlalchemy_model() made of a row below calling.
+
+        It builds a new instance of a row for every path reaching it and
+        stops recursing into a class seen twice above, so the content of
+        the instance depends on the row and on those counts only.
+        """
+        return frozenset((model, min(calling.count(model), 2))
+                         for model in calling)
+
+    @classmethod
+    def _nested(cls, entity, memo, calling, ancestry):
+        entity_id = getattr(entity, 'id', None)
+        if entity_id is None:
+            key = id(entity)
+        else:
+            key = (type(entity), entity_id, ancestry)
+        if key not in memo:
+            memo[key] = cls._model_dict(entity, lambda attr: False, memo,
+                                        calling)
+        return memo[key]
+
+    @classmethod
+    def _model_dict(cls, entity, excluded, memo, calling):
+        """Walk entity the way BaseDataModel.to_dict() does."""
+        calling = calling + (type(entity),)
+        ancestry = None
+        obj_dict = {}
+        for attr, value in vars(entity).items():
+            if attr.startswith('_') or excluded(attr):
+                continue
+            if isinstance(value, data_models.BaseDataModel):
+                if ancestry is None:
+                    ancestry = cls._ancestry(calling)
+                obj_dict[attr] = cls._nested(value, memo, calling, ancestry)
+            elif isinstance(value, list):
+                obj_dict[attr] = []
+                for item in value:
+                    if isinstance(item, data_models.BaseDataModel):
+                        if ancestry is None:
+                            ancestry = cls._ancestry(calling)
+                        obj_dict[attr].append(
+                            cls._nested(item, memo, calling, ancestry))
+                    else:
+                        # to_dict() keeps the last plain item only
+                        obj_dict[attr] = item
+            else:
+                obj_dict[attr] = value
+        return obj_dict
+
+
+class _PendingCast(object):
+
+    def __init__(self, key, context, msg, kwargs):
+        self.key = key
+        self.context = context
+        self.msg = msg
+        self.kwargs = kwargs
+
+    @property
+    def op(self):
+        return self.key[0] if self.key else None
+
+
+class CastCoalescer(object):
+    """Buffer casts and collapse successive operations on one object.
+
+    Pending casts are kept in a single FIFO, so the relative order of the
+    messages -- and hence the order per loadbalancer -- is preserved. A
+    new cast is folded into an earlier pending cast for the same
+    (object type, id) only when everything queued after that cast is an
+    update, so no create or delete of another object is ever reordered.
+
+    The agent never reports on casts that are not sent: on_cancel(context,
+    msg) is called with the delete of a cancelled create+delete pair and
+    on_error(context, msg) with a cast that failed to be sent, so the
+    operation can be completed locally.
+
+    Nothing is ever merged behind the neutron-lbaas plugin, which
+    refuses an operation on a loadbalancer until the agent reported on
+    the previous one.
+    """
+
+    # _merge() result for a create+delete pair dropped altogether
+    CANCELLED = 'cancelled'
+
+    def __init__(self, send, window, on_cancel=None, on_error=None):
+        self._send = send
+        self._window = window
+        self._on_cancel = on_cancel
+        self._on_error = on_error
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+    @staticmethod
+    def _key(msg):
+        match = _COALESCE_METHOD.match(msg['method'])
+        obj = msg['args'].get('obj')
+        if not match or obj is None:
+            return None
+        if isinstance(obj, dict):
+            obj_id = obj.get('id')
+        else:
+            obj_id = getattr(obj, 'id', None)
+        if obj_id is None:
+            return None
+        return (match.group(1), match.group(2), obj_id)
+
+    def add(self, context, msg, kwargs):
+        key = self._key(msg)
+        with self._lock:
+            merged = key is not None and self._merge(key, context, msg,
+                                                     kwargs)
+            if not merged:
+                self._pending.append(_PendingCast(key, context, msg, kwargs))
+            if self._timer is None:
+                self._timer = threading.Timer(self._window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if merged == self.CANCELLED and self._on_cancel:
+            self._on_cancel(context, msg)
+
+    def _merge(self, key, context, msg, kwargs):
+        """Fold msg into a pending cast.
+
+        :returns: True if it was absorbed, CANCELLED if it cancelled a
+            pending create, False otherwise
+        """
+
+        for index in range(len(self._pending) - 1, -1, -1):
+            pending = self._pending[index]
+            if pending.key is not None and pending.key[1:] == key[1:]:
+                break
+            if pending.op != 'update':
+                return False
+        else:
+            return False
+
+        op = key[0]
+        if op == 'update' and pending.op in ('create', 'update'):
+            # keep the earliest old_obj, ship the latest state
+            pending.msg['args']['obj'] = msg['args']['obj']
+            pending.context = context
+            pending.kwargs = kwargs
+            return True
+        if op == 'delete' and pending.op == 'create':
+            if index == len(self._pending) - 1:
+                # the agent never saw the object, drop both casts
+                del self._pending[index]
+                return self.CANCELLED
+            return False
+        if op == 'delete' and pending.op == 'update':
+            del self._pending[index]
+        return False
+
+    def flush(self):
+        with self._send_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                self._timer = None
+            for cast in pending:
+                try:
+                    self._send(cast.context, cast.msg, **cast.kwargs)
+                except Exception as e:
+                    LOG.error("Exception: coalesced %s: %s" %
+                              (cast.msg['method'], e))
+                    if self._on_error:
+                        self._on_error(cast.context, cast.msg)
+
+
+class L7RuleBatcher(object):
+    """Collect the rule changes of each L7 policy into one cast.
+
+    Changes are held for window seconds and sent per policy as an
+    ordered list, with a change to a rule already in the list folded
+    into it. The pending changes of a loadbalancer must be flushed
+    before any other cast for it, so the agent sees them in order.
+
+    :param send: callable(context, loadbalancer_id, l7policy_id, changes,
+        kwargs) casting the changes of one policy
+    :param on_cancel: callable(context, rule) called for a rule created
+        and deleted within the window, which the agent never hears of
+    :param on_error: callable(context, changes) called with the changes
+        of a policy that could not be sent
+    """
+
+    def __init__(self, send, window, on_cancel=None, on_error=None):
+        self._send = send
+        self._window = window
+        self._on_cancel = on_cancel
+        self._on_error = on_error
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        # loadbalancer id -> policy id -> [context, kwargs, changes]
+        self._pending = collections.OrderedDict()
+        self._timer = None
+
+    def add(self, context, loadbalancer_id, l7policy_id, op, rule, kwargs):
+        with self._lock:
+            policies = self._pending.setdefault(
+                loadbalancer_id, collections.OrderedDict())
+            if l7policy_id not in policies:
+                policies[l7policy_id] = [context, kwargs, []]
+            pending = policies[l7policy_id]
+            pending[0] = context
+            pending[1] = kwargs
+            cancelled = self._fold(pending[2], op, rule)
+            if self._timer is None:
+                self._timer = threading.Timer(self._window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if cancelled and self._on_cancel:
+            self._on_cancel(context, rule)
+
+    @staticmethod
+    def _fold(changes, op, rule):
+        """Add a change, returns True if it cancelled a pending create."""
+        for index, change in enumerate(changes):
+            if change['obj']['id'] != rule['id']:
+                continue
+            if op == 'update':
+                # a create stays a create, with the latest state
+                change['obj'] = rule
+                return False
+            if op == 'delete' and change['op'] == 'create':
+                # the agent never saw the rule
+                del changes[index]
+                return True
+            if op == 'delete':
+                del changes[index]
+            break
+        changes.append({'op': op, 'obj': rule})
+        return False
+
+    def flush(self, loadbalancer_id=None):
+        with self._send_lock:
+            with self._lock:
+                if loadbalancer_id is None:
+                    pending = self._pending
+                    self._pending = collections.OrderedDict()
+                    self._timer = None
+                elif loadbalancer_id in self._pending:
+                    pending = {loadbalancer_id:
+                               self._pending.pop(loadbalancer_id)}
+                else:
+                    return
+            for lb_id, policies in pending.items():
+                for l7policy_id, (context, kwargs, changes) in (
+                        policies.items()):
+                    if not changes:
+                        continue
+                    try:
+                        self._send(context, lb_id, l7policy_id, changes,
+                                   kwargs)
+                    except Exception as e:
+                        LOG.error("Exception: l7 rule batch of %s: %s" %
+                                  (l7policy_id, e))
+                        if self._on_error:
+                            self._on_error(context, changes)
+
 
 class LBaaSv2AgentRPC(object):
 
@@ -39,13 +483,53 @@ class LBaaSv2AgentRPC(object):
         self.driver = driver
         self.topic = constants_v2.TOPIC_LOADBALANCER_AGENT_V2
         self._create_rpc_publisher()
+        self._prepared_clients = cache.LRUCache(
+            cfg.CONF.arraynetworks.array_rpc_client_cache_size)
+        self._route_to_host = cfg.CONF.arraynetworks.array_rpc_host_routing
+        self._ring = utils.HashRing()
+
+        self._coalescer = None
+        window = cfg.CONF.arraynetworks.array_rpc_coalesce_window
+        if window > 0:
+            self._coalescer = CastCoalescer(
+                self._send_cast, window / 1000.0,
+                on_cancel=self._complete_deleted,
+                on_error=self._complete_failed)
+
+        self._rule_batcher = None
+        window = cfg.CONF.arraynetworks.array_l7rule_batch_window
+        if window > 0 and self.can_send_l7_rules():
+            self._rule_batcher = L7RuleBatcher(
+                self._send_rule_batch, window / 1000.0,
+                on_cancel=self._complete_deleted_rule,
+                on_error=self._complete_failed_rules)
+
+        self._dispatcher = None
+        if cfg.CONF.arraynetworks.array_rpc_dispatch_workers > 0:
+            self._dispatcher = workers.PartitionedWorkerPool(
+                'array-dispatch',
+                cfg.CONF.arraynetworks.array_rpc_dispatch_workers,
+                maxsize=cfg.CONF.arraynetworks.array_rpc_dispatch_queue_size,
+                lanes=workers.PRIORITY_LOW + 1,
+                starvation_limit=(cfg.CONF.arraynetworks.
+                                  array_rpc_dispatch_starvation_limit))
+
+        self._outbox = None
+        if cfg.CONF.arraynetworks.array_rpc_outbox:
+            self._outbox = outbox.CastOutbox(self._send_cast)
+            self._outbox.start()
 
     def _create_rpc_publisher(self):
         target = messaging.Target(topic=self.topic,
                                   version=constants_v2.BASE_RPC_API_VERSION)
-        self._client = rpc.get_client(target,
-                                      serializer=DataModelSerializer(),
-                                      version_cap=None)
+        projections = dict(
+            (method, set(fields.split('|'))) for method, fields in
+            cfg.CONF.arraynetworks.array_rpc_field_projections.items())
+        self._serializer = DataModelSerializer(projections)
+        self._client = rpc.get_client(
+            target,
+            serializer=self._serializer,
+            version_cap=cfg.CONF.arraynetworks.array_agent_rpc_version_cap)
 
     def make_msg(self, method, **kwargs):
         return {'method': method,
@@ -56,9 +540,166 @@ class LBaaSv2AgentRPC(object):
         return self.__call_rpc_method(
             context, msg, rpc_method='call', **kwargs)
 
-    def cast(self, context, msg, **kwargs):
+    def start_workers(self):
+        """Start the dispatch workers of a forked process."""
+        if self._dispatcher:
+            self._dispatcher.start()
+
+    def set_agent_hosts(self, hosts):
+        """Update the live agent hosts used for consistent hash routing."""
+        self._ring.set_nodes(hosts)
+
+    def _routing_key(self, msg):
+        if msg['args'].get('loadbalancer_id'):
+            return msg['args']['loadbalancer_id']
+        obj = msg['args'].get('obj')
+        if obj is None and msg['args'].get('objs'):
+            obj = msg['args']['objs'][0]
+        key = utils.get_root_loadbalancer_id(obj)
+        if key is None and obj is not None:
+            key = obj.get('id') if isinstance(obj, dict) else obj.id
+        return key
+
+    def cast(self, context, msg, host=None, **kwargs):
+        if self._route_to_host and not kwargs.get('fanout'):
+            server = host
+            if not server:
+                if self.driver:
+                    self.driver.check_agents()
+                key = self._routing_key(msg)
+                server = self._ring.get_node(key) if key else None
+            if server:
+                kwargs['server'] = server
+        if self._rule_batcher:
+            key = self._routing_key(msg)
+            match = _L7RULE_METHOD.match(msg['method'])
+            if match and key:
+                rule = self._serializer.serialize_entity(
+                    context, msg['args']['obj'])
+                self._rule_batcher.add(context, key, rule['l7policy_id'],
+                                       match.group(1), rule, kwargs)
+                return
+            if key:
+                self._rule_batcher.flush(key)
+        self._enqueue(context, msg, kwargs)
+
+    def _send_rule_batch(self, context, loadbalancer_id, l7policy_id,
+                         changes, kwargs):
+        kwargs = dict(kwargs,
+                      version=constants_v2.L7_RULES_RPC_API_VERSION)
+        self._enqueue(
+            context,
+            self.make_msg(
+                'update_l7policy_rules',
+                loadbalancer_id=loadbalancer_id,
+                l7policy_id=l7policy_id,
+                changes=changes
+            ),
+            kwargs)
+
+    def _enqueue(self, context, msg, kwargs):
+        if self._outbox:
+            args = self._serializer.serialize_message(msg['method'],
+                                                      msg['args'])
+            self._outbox.add(context, self._routing_key(msg),
+                             dict(msg, args=args), kwargs)
+        elif self._dispatcher:
+            priority = _cast_priority(msg)
+            if not self._dispatcher.offer_with_priority(
+                    priority, self._routing_key(msg), self._dispatch_queued,
+                    context, msg, kwargs):
+                if (cfg.CONF.arraynetworks.array_rpc_dispatch_full_policy ==
+                        'reject'):
+                    raise array_exc.ArrayDispatchQueueFullException()
+                LOG.warning("Dispatch queue full, waiting to queue %s" %
+                            msg['method'])
+                self._dispatcher.submit_with_priority(
+                    priority, self._routing_key(msg), self._dispatch_queued,
+                    context, msg, kwargs)
+        else:
+            self._dispatch_cast(context, msg, kwargs)
+
+    def _dispatch_queued(self, context, msg, kwargs):
+        """Dispatch a cast on a dispatch worker, with no caller to raise to."""
+        try:
+            self._dispatch_cast(context, msg, kwargs)
+        except Exception as e:
+            LOG.error("Exception: dispatch of %s: %s" % (msg['method'], e))
+            self._complete_failed(context, msg)
+
+    def _dispatch_cast(self, context, msg, kwargs):
+        if self._coalescer:
+            self._coalescer.add(context, msg, kwargs)
+        else:
+            self._send_cast(context, msg, **kwargs)
+
+    def _local_completion(self, obj_type, obj, outcome):
+        try:
+            self.driver.callbacks.local_completion(obj_type, obj, outcome)
+        except Exception as e:
+            LOG.error("Exception: local completion of %s: %s" %
+                      (obj_type, e))
+
+    def _msg_completion(self, context, msg, outcome):
+        match = _COALESCE_METHOD.match(msg['method'])
+        if not match:
+            LOG.error("No local completion for %s" % msg['method'])
+            return
+        obj_type = _COMPLETION_OBJ_TYPES.get(match.group(2), match.group(2))
+        self._local_completion(obj_type, msg['args']['obj'], outcome)
+
+    def _complete_deleted(self, context, msg):
+        """Finish the delete of an object the agent never created."""
+        self._msg_completion(context, msg, 'delete')
+
+    def _complete_failed(self, context, msg):
+        """Put the object of a cast that could not be sent in ERROR."""
+        if msg['method'] == 'update_l7policy_rules':
+            self._complete_failed_rules(context, msg['args']['changes'])
+        else:
+            self._msg_completion(context, msg, 'fail')
+
+    def _complete_deleted_rule(self, context, rule):
+        self._local_completion('l7rule', rule, 'delete')
+
+    def _complete_failed_rules(self, context, changes):
+        for change in changes:
+            self._local_completion('l7rule', change['obj'], 'fail')
+
+    def get_dispatch_stats(self):
+        if self._dispatcher is None:
+            return {}
+        return self._dispatcher.stats()
+
+    def get_outbox_stats(self):
+        if self._outbox is None:
+            return {}
+        return self._outbox.stats()
+
+    def _send_cast(self, context, msg, **kwargs):
+        if ('old_obj' in msg['args'] and self._client.can_send_version(
+                constants_v2.DELTA_RPC_API_VERSION)):
+            msg = self._make_delta_msg(msg)
+            kwargs['version'] = constants_v2.DELTA_RPC_API_VERSION
         self.__call_rpc_method(context, msg, rpc_method='cast', **kwargs)
 
+    def _make_delta_msg(self, msg):
+        """Replace old_obj/obj of an update_* message by a field diff."""
+
+        args = self._serializer.serialize_message(msg['method'], msg['args'])
+        old = args['old_obj']
+        new = args['obj']
+        delta = dict((key, value) for key, value in new.items()
+                     if key not in old or old[key] != value)
+        removed = [key for key in old if key not in new]
+        return self.make_msg(
+            msg['method'],
+            obj_id=new['id'],
+            delta=delta,
+            removed=removed,
+            old_hash=digest.content_hash(old)
+        )
+
     def fanout_cast(self, context, msg, **kwargs):
         kwargs['fanout'] = True
         self.__call_rpc_method(context, msg, rpc_method='cast', **kwargs)
@@ -73,12 +714,23 @@ class LBaaSv2AgentRPC(object):
             options['namespace'] = msg['namespace']
 
         if options:
-            callee = self._client.prepare(**options)
+            callee = self._get_prepared_client(options)
         else:
             callee = self._client
 
+        args = self._serializer.serialize_message(msg['method'], msg['args'])
         func = getattr(callee, kwargs['rpc_method'])
-        return func(context, msg['method'], **msg['args'])
+        return func(context, msg['method'], **args)
+
+    def _get_prepared_client(self, options):
+        key = tuple(options.get(opt) for opt in
+                    ('topic', 'server', 'fanout', 'version', 'timeout',
+                     'namespace'))
+        callee = self._prepared_clients.get(key)
+        if callee is None:
+            callee = self._client.prepare(**options)
+            self._prepared_clients.set(key, callee)
+        return callee
 
     @log_helpers.log_method_call
     def create_loadbalancer(self, context, loadbalancer, host):
@@ -88,7 +740,8 @@ class LBaaSv2AgentRPC(object):
                 'create_loadbalancer',
                 obj=loadbalancer
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def update_loadbalancer(
@@ -105,7 +758,8 @@ class LBaaSv2AgentRPC(object):
                 old_obj=old_loadbalancer,
                 obj=loadbalancer
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def delete_loadbalancer(self, context, loadbalancer, host):
@@ -115,7 +769,34 @@ class LBaaSv2AgentRPC(object):
                 'delete_loadbalancer',
                 obj=loadbalancer
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
+
+    def can_send_l7_rules(self):
+        return self._client.can_send_version(
+            constants_v2.L7_RULES_RPC_API_VERSION)
+
+    def can_delete_cascade(self):
+        return self._client.can_send_version(
+            constants_v2.CASCADE_RPC_API_VERSION)
+
+    @log_helpers.log_method_call
+    def delete_loadbalancer_cascade(self, context, loadbalancer, host):
+        """Delete loadbalancer and every object it holds in one cast.
+
+        The agent reports the outcome of each object with one
+        bulk_completion call, passing the loadbalancer id along since the
+        nested objects of the tree do not all reference it.
+        """
+        return self.cast(
+            context,
+            self.make_msg(
+                'delete_loadbalancer_cascade',
+                obj=loadbalancer
+            ),
+            topic=self.topic,
+            host=host,
+            version=constants_v2.CASCADE_RPC_API_VERSION)
 
     @log_helpers.log_method_call
     def update_loadbalancer_stats(
@@ -130,7 +811,46 @@ class LBaaSv2AgentRPC(object):
                 'update_loadbalancer_stats',
                 obj=loadbalancer
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
+
+    def can_refresh(self):
+        return self._client.can_send_version(
+            constants_v2.REFRESH_RPC_API_VERSION)
+
+    @log_helpers.log_method_call
+    def get_loadbalancer_digests(self, context, loadbalancer_ids, host,
+                                 compact=False):
+        """Ask the agent on host for the object digests it holds.
+
+        :returns: {loadbalancer_id: {object key: digest}}, or with compact
+            {loadbalancer_id: digest.compact_digest() of those}
+        """
+        return self.call(
+            context,
+            self.make_msg(
+                'get_loadbalancer_digests',
+                loadbalancer_ids=loadbalancer_ids,
+                compact=compact
+            ),
+            topic=self.topic,
+            server=host,
+            version=constants_v2.REFRESH_RPC_API_VERSION)
+
+    @log_helpers.log_method_call
+    def refresh_loadbalancer(self, context, loadbalancer, changed, removed,
+                             host):
+        return self.cast(
+            context,
+            self.make_msg(
+                'refresh_loadbalancer',
+                obj=loadbalancer,
+                changed=changed,
+                removed=removed
+            ),
+            topic=self.topic,
+            host=host,
+            version=constants_v2.REFRESH_RPC_API_VERSION)
 
     @log_helpers.log_method_call
     def create_listener(self, context, listener, host):
@@ -140,7 +860,8 @@ class LBaaSv2AgentRPC(object):
                 'create_listener',
                 obj=listener
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def update_listener(self, context, old_listener, listener, host):
@@ -151,7 +872,8 @@ class LBaaSv2AgentRPC(object):
                 old_obj=old_listener,
                 obj=listener
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def delete_listener(self, context, listener, host):
@@ -161,7 +883,8 @@ class LBaaSv2AgentRPC(object):
                 'delete_listener',
                 obj=listener
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def create_pool(self, context, pool, host):
@@ -171,7 +894,8 @@ class LBaaSv2AgentRPC(object):
                 'create_pool',
                 obj=pool
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def update_pool(self, context, old_pool, pool, host):
@@ -182,7 +906,8 @@ class LBaaSv2AgentRPC(object):
                 old_obj=old_pool,
                 obj=pool
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def delete_pool(self, context, pool, host):
@@ -192,7 +917,8 @@ class LBaaSv2AgentRPC(object):
                 'delete_pool',
                 obj=pool
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def create_member(self, context, member, host):
@@ -202,7 +928,8 @@ class LBaaSv2AgentRPC(object):
                 'create_member',
                 obj=member
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def update_member(self, context, old_member, member, host):
@@ -213,7 +940,8 @@ class LBaaSv2AgentRPC(object):
                 old_obj=old_member,
                 obj=member
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def delete_member(self, context, member, host):
@@ -223,7 +951,42 @@ class LBaaSv2AgentRPC(object):
                 'delete_member',
                 obj=member
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
+
+    @log_helpers.log_method_call
+    def create_members(self, context, members, host):
+        return self.cast(
+            context,
+            self.make_msg(
+                'create_members',
+                objs=members
+            ),
+            topic=self.topic,
+            host=host)
+
+    @log_helpers.log_method_call
+    def update_members(self, context, old_members, members, host):
+        return self.cast(
+            context,
+            self.make_msg(
+                'update_members',
+                old_objs=old_members,
+                objs=members
+            ),
+            topic=self.topic,
+            host=host)
+
+    @log_helpers.log_method_call
+    def delete_members(self, context, members, host):
+        return self.cast(
+            context,
+            self.make_msg(
+                'delete_members',
+                objs=members
+            ),
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def create_health_monitor(self, context, health_monitor, host):
@@ -233,7 +996,8 @@ class LBaaSv2AgentRPC(object):
                 'create_health_monitor',
                 obj=health_monitor
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def update_health_monitor(
@@ -250,7 +1014,8 @@ class LBaaSv2AgentRPC(object):
                 old_obj=old_health_monitor,
                 obj=health_monitor
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def delete_health_monitor(self, context, health_monitor, host):
@@ -260,7 +1025,8 @@ class LBaaSv2AgentRPC(object):
                 'delete_health_monitor',
                 obj=health_monitor
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def create_l7policy(self, context, l7policy, host):
@@ -270,7 +1036,21 @@ class LBaaSv2AgentRPC(object):
                 'create_l7policy',
                 obj=l7policy
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
+
+    @log_helpers.log_method_call
+    def create_l7policy_with_rules(self, context, l7policy, host):
+        """Create an L7 policy along with the rules it carries."""
+        return self.cast(
+            context,
+            self.make_msg(
+                'create_l7policy_with_rules',
+                obj=l7policy
+            ),
+            topic=self.topic,
+            host=host,
+            version=constants_v2.L7_RULES_RPC_API_VERSION)
 
     @log_helpers.log_method_call
     def update_l7policy(self, context, old_l7policy, l7policy, host):
@@ -281,7 +1061,8 @@ class LBaaSv2AgentRPC(object):
                 old_obj=old_l7policy,
                 obj=l7policy
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def delete_l7policy(self, context, l7policy, host):
@@ -291,7 +1072,8 @@ class LBaaSv2AgentRPC(object):
                 'delete_l7policy',
                 obj=l7policy
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def create_l7rule(self, context, l7rule, host):
@@ -301,7 +1083,8 @@ class LBaaSv2AgentRPC(object):
                 'create_l7rule',
                 obj=l7rule
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def update_l7rule(self, context, old_l7rule, l7rule, host):
@@ -312,7 +1095,8 @@ class LBaaSv2AgentRPC(object):
                 old_obj=old_l7rule,
                 obj=l7rule
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
 
     @log_helpers.log_method_call
     def delete_l7rule(self, context, l7rule, host):
@@ -322,4 +1106,5 @@ class LBaaSv2AgentRPC(object):
                 'delete_l7rule',
                 obj=l7rule
             ),
-            topic=self.topic)
+            topic=self.topic,
+            host=host)
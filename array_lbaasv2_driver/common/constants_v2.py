@@ -17,4 +17,13 @@ TOPIC_PROCESS_ON_HOST_V2 = 'array-lbaasv2-process-on-controller'
 TOPIC_LOADBALANCER_AGENT_V2 = 'array-lbaasv2-process-on-agent'
 
 BASE_RPC_API_VERSION = '1.0'
+# 1.1 - update_* casts may carry obj_id/delta/removed/old_hash instead of
+#       the full old_obj and obj
+DELTA_RPC_API_VERSION = '1.1'
+# 1.2 - get_loadbalancer_digests call and refresh_loadbalancer cast
+REFRESH_RPC_API_VERSION = '1.2'
+# 1.3 - delete_loadbalancer_cascade cast
+CASCADE_RPC_API_VERSION = '1.3'
+# 1.4 - create_l7policy_with_rules and update_l7policy_rules casts
+L7_RULES_RPC_API_VERSION = '1.4'
 RPC_API_NAMESPACE = None
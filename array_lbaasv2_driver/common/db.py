@@ -12,12 +12,19 @@
 # limitations under the License.
 #
 
+import threading
 import time
 
 from oslo_log import log as logging
 from oslo_config import cfg
 
 from neutron.plugins.ml2 import models
+from neutron_lib.api.definitions import portbindings
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
+
+from array_lbaasv2_driver.common import cache
 
 CMCC_DEFAULT_LEVEL = 1
 CMCC_DEFAULT_NETWORK_TYPE = 'vlan'
@@ -40,85 +47,214 @@ DB_OPTS = [
     cfg.StrOpt(
         'array_request_vlan_hostname',
         default=10,
-        help=('Hostname of port binding')
+        help=('Hostname of port binding. Deprecated, the binding level is '
+              'looked up regardless of host')
+    ),
+    cfg.IntOpt(
+        'array_request_vlan_timeout',
+        default=0,
+        help=('Seconds to wait for the VLAN ID of a port. 0 waits '
+              'array_request_vlan_interval times '
+              'array_request_vlan_max_retries, or forever when the '
+              'retries are 0')
+    ),
+    cfg.IntOpt(
+        'array_vlan_cache_size',
+        default=4096,
+        help=('Number of port to VLAN ID mappings cached. Entries are '
+              'dropped when the port is deleted or its binding changes. '
+              '0 disables the cache')
+    ),
+    cfg.IntOpt(
+        'array_vlan_cache_ttl',
+        default=300,
+        help=('Seconds a port to VLAN ID mapping is cached. Bindings '
+              'changed in other neutron-server processes are picked up '
+              'once the entry expires. 0 keeps entries until they are '
+              'dropped by a port event')
     )
 ]
 
 cfg.CONF.register_opts(DB_OPTS, "arraynetworks")
 
-def _get_binding_level(context, port_id, level):
-    result = None
-    host = None
-    if port_id:
-        host = cfg.CONF.arraynetworks.array_request_vlan_hostname
-        if not host:
-            LOG.error("Unable to get host by port_id %(port_id)s", {'port_id': port_id})
-            return result
-        LOG.debug("For port %(port_id)s, got binding host %(host)s",
-                {'port_id': port_id, 'host': host})
-        result = (context.session.query(models.PortBindingLevel).
-                  filter_by(port_id=port_id, host=host, level=level).
-                  first())
-
-        result = (context.session.query(models.PortBindingLevel).
-                  filter_by(port_id=port_id, level=level).
-                  first())
-        LOG.debug("For port %(port_id)s, level %(level)s, "
-                  "got binding levels %(levels)s",
-                  {'port_id': port_id,
-                   'level': level,
-                   'levels': result})
+_port_waiters = {}
+_port_waiters_lock = threading.Lock()
+_port_events_subscribed = False
+_vlan_cache = None
+
+_BINDING_ATTRS = (portbindings.HOST_ID, portbindings.VIF_TYPE,
+                  portbindings.VNIC_TYPE, portbindings.PROFILE)
+
+def _get_vlan_cache():
+    global _vlan_cache
+    size = cfg.CONF.arraynetworks.array_vlan_cache_size
+    if _vlan_cache is None and size > 0:
+        ttl = cfg.CONF.arraynetworks.array_vlan_cache_ttl
+        _vlan_cache = cache.LRUCache(size, ttl=ttl if ttl > 0 else None)
+    return _vlan_cache
+
+def get_vlan_cache_stats():
+    vlan_cache = _get_vlan_cache()
+    return vlan_cache.stats() if vlan_cache is not None else {}
+
+def _event_ports(kwargs):
+    """Return (port_id, original port, port) of a port event."""
+    payload = kwargs.get('payload')
+    if payload is not None:
+        states = getattr(payload, 'states', None) or (None,)
+        return (payload.resource_id, states[0],
+                getattr(payload, 'latest_state', None))
+    port = kwargs.get('port') or {}
+    return (port.get('id') or kwargs.get('port_id'),
+            kwargs.get('original_port'), port)
+
+def _binding_changed(original, port):
+    if not original or not port:
+        return True
+    return any(original.get(attr) != port.get(attr)
+               for attr in _BINDING_ATTRS)
+
+def _port_updated(resource, event, trigger, **kwargs):
+    port_id, original, port = _event_ports(kwargs)
+    vlan_cache = _get_vlan_cache()
+    if vlan_cache is not None and _binding_changed(original, port):
+        vlan_cache.pop(port_id)
+    with _port_waiters_lock:
+        waiter = _port_waiters.get(port_id)
+        if waiter:
+            waiter[0].set()
+
+def _port_deleted(resource, event, trigger, **kwargs):
+    port_id = _event_ports(kwargs)[0]
+    vlan_cache = _get_vlan_cache()
+    if vlan_cache is not None:
+        vlan_cache.pop(port_id)
+
+def subscribe_port_events():
+    """Track port updates and deletes.
+
+    Updates wake VLAN lookups waiting on the port, and binding changes
+    and deletes drop the cached VLAN ID of the port.
+    """
+    global _port_events_subscribed
+    registry.subscribe(_port_updated, resources.PORT, events.AFTER_UPDATE)
+    registry.subscribe(_port_deleted, resources.PORT, events.AFTER_DELETE)
+    _port_events_subscribed = True
+
+def _add_port_waiter(port_id):
+    with _port_waiters_lock:
+        waiter = _port_waiters.setdefault(port_id, [threading.Event(), 0])
+        waiter[1] += 1
+        return waiter[0]
+
+def _remove_port_waiter(port_id):
+    with _port_waiters_lock:
+        waiter = _port_waiters[port_id]
+        waiter[1] -= 1
+        if not waiter[1]:
+            del _port_waiters[port_id]
+
+def _get_segmentation_ids(context, port_ids):
+    """Map port ids to the VLAN ID of their binding with one joined query.
+
+    Ports without a VLAN segment bound at CMCC_DEFAULT_LEVEL are left out.
+    """
+    result = {}
+    if not port_ids:
+        return result
+    query = (context.session.query(models.PortBindingLevel.port_id,
+                                   models.NetworkSegment.segmentation_id).
+             join(models.NetworkSegment,
+                  models.NetworkSegment.id ==
+                  models.PortBindingLevel.segment_id).
+             filter(models.PortBindingLevel.port_id.in_(port_ids),
+                    models.PortBindingLevel.level == CMCC_DEFAULT_LEVEL,
+                    models.NetworkSegment.network_type ==
+                    CMCC_DEFAULT_NETWORK_TYPE))
+    for port_id, segmentation_id in query:
+        result[port_id] = str(segmentation_id)
+    LOG.debug("For ports %(port_ids)s got VLAN IDs %(vlan_ids)s",
+              {'port_ids': port_ids, 'vlan_ids': result})
     return result
 
-def _get_network_segment(context, segment_id, network_type):
-    result = None
-    if segment_id:
-        result = (context.session.query(models.NetworkSegment).
-                  filter_by(id=segment_id, network_type=network_type).
-                  first())
-        LOG.debug("For segment %(segment_id)s, network type %(network_type)s, "
-                  "got binding levels %(networksegments)s",
-                  {'segment_id': segment_id,
-                   'network_type': network_type,
-                   'networksegments': result})
+def _lookup_vlan_id(context, port_id):
+    return _get_segmentation_ids(context, [port_id]).get(port_id)
+
+def get_vlan_ids_by_ports(context, port_ids, chunk_size=500):
+    """Resolve the VLAN ID of many ports at once, without waiting.
+
+    :returns: dict port_id -> VLAN ID, None for ports not bound yet
+    """
+    result = dict((port_id, None) for port_id in port_ids)
+    vlan_cache = _get_vlan_cache()
+    if vlan_cache is not None:
+        for port_id in result:
+            result[port_id] = vlan_cache.get(port_id)
+    missing = [port_id for port_id, vlan_id in result.items() if not vlan_id]
+    for start in range(0, len(missing), chunk_size):
+        found = _get_segmentation_ids(context,
+                                      missing[start:start + chunk_size])
+        result.update(found)
+        if vlan_cache is not None:
+            for port_id, vlan_id in found.items():
+                vlan_cache.set(port_id, vlan_id)
     return result
 
-def get_vlan_id_by_port_cmcc(context, port_id):
-    vlan_id = None
+def get_vlan_id_by_port_cmcc(context, port_id, wait=True):
+    """Return the VLAN ID of port_id, waiting for its binding if needed.
+
+    The database is polled every array_request_vlan_interval. When port
+    events are subscribed, an update of the port in this process retries
+    the lookup right away; bindings done by other workers are still
+    picked up by the poll. Without wait, None is returned at once for a
+    port not bound yet.
+    Resolved VLAN IDs are cached until the port binding changes.
+    """
 
     if not port_id:
         LOG.error("should provide the port_id")
         return None
 
-    attempts = 0
-    seconds_time = int(cfg.CONF.arraynetworks.array_request_vlan_interval) / 1000
-    retries = int(cfg.CONF.arraynetworks.array_request_vlan_max_retries)
-    while True:
-        if attempts < retries:
-            attempts += 1
-        elif retries == 0:
-            attempts = 0
-        else:
-            msg = ("Unable to get the vlan id. Exiting after "
-                  "%(retries)s attempts") % {'retries': retries}
-            LOG.error(msg)
-            return None
-
-        binding_level = _get_binding_level(context, port_id, CMCC_DEFAULT_LEVEL)
-        if not binding_level:
-            LOG.error("Unable to get binding_level using %(port_id)s", {'port_id': port_id})
-            time.sleep(seconds_time)
-            continue
-
-        segment_id = binding_level.segment_id
-        network_segment = _get_network_segment(context, segment_id, CMCC_DEFAULT_NETWORK_TYPE)
-        if not network_segment:
-            LOG.error("Unable to get network_segment using %(segment_id)s", {'segment_id': segment_id})
-            time.sleep(seconds_time)
-            continue
-        else:
-            vlan_id = str(network_segment.segmentation_id)
-            break
-
-    return vlan_id
+    vlan_cache = _get_vlan_cache()
+    if vlan_cache is not None:
+        vlan_id = vlan_cache.get(port_id)
+        if vlan_id:
+            return vlan_id
+
+    if not wait:
+        vlan_id = _lookup_vlan_id(context, port_id)
+        if vlan_id and vlan_cache is not None:
+            vlan_cache.set(port_id, vlan_id)
+        return vlan_id
+
+    conf = cfg.CONF.arraynetworks
+    interval = int(conf.array_request_vlan_interval) / 1000.0
+    retries = int(conf.array_request_vlan_max_retries)
+    if conf.array_request_vlan_timeout > 0:
+        deadline = time.time() + conf.array_request_vlan_timeout
+    elif retries > 0:
+        deadline = time.time() + retries * interval
+    else:
+        deadline = None
+
+    woken = _add_port_waiter(port_id)
+    try:
+        while True:
+            woken.clear()
+            vlan_id = _lookup_vlan_id(context, port_id)
+            if vlan_id:
+                if vlan_cache is not None:
+                    vlan_cache.set(port_id, vlan_id)
+                return vlan_id
 
+            timeout = interval
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    LOG.error("Unable to get the vlan id of port %s before "
+                              "the deadline" % port_id)
+                    return None
+                timeout = min(timeout, remaining)
+            woken.wait(timeout)
+    finally:
+        _remove_port_waiter(port_id)
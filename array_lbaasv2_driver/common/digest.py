@@ -0,0 +1,186 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Content digests of serialized loadbalancer trees.
+
+A loadbalancer tree is split in objects keyed "<type>:<id>": the
+loadbalancer, its listeners, pools, members, health monitors and L7
+policies (an L7 policy includes its rules). The digest of an object only
+covers its own configuration, nested objects and status fields are left
+out at any depth (session persistence and SNI containers carry
+back-references to their pool and listener), so the digest of an object
+changes exactly when the object has to be pushed to the agent again.
+"""
+
+import hashlib
+
+from oslo_serialization import jsonutils
+import sqlalchemy as sa
+from sqlalchemy.ext import declarative
+
+from neutron_lib import context as ncontext
+
+# fields changed by the agent itself
+STATUS_FIELDS = frozenset(['provisioning_status', 'operating_status',
+                           'stats'])
+
+# kept apart from the neutron models like the outbox table, created on
+# startup
+BASE = declarative.declarative_base()
+
+# references to other objects, which have digests of their own
+RELATION_FIELDS = frozenset([
+    'loadbalancer', 'listener', 'listeners', 'pool', 'pools', 'members',
+    'healthmonitor', 'default_pool', 'redirect_pool', 'l7_policies',
+    'rules', 'policy', 'vip_port', 'vip_subnet', 'subnet', 'provider',
+    'flavor', 'default_tls_container'])
+
+
+def content_hash(obj_dict):
+    """Stable digest of a serialized object, independent of key order."""
+    data = jsonutils.dumps(obj_dict, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _strip(value):
+    if isinstance(value, dict):
+        return _own_fields(value)
+    if isinstance(value, (list, tuple)):
+        return [_strip(item) for item in value]
+    return value
+
+
+def _own_fields(obj_dict):
+    return dict((key, _strip(value)) for key, value in obj_dict.items()
+                if key not in STATUS_FIELDS and key not in RELATION_FIELDS)
+
+
+def split_loadbalancer(lb_dict):
+    """Return {key: own dict} for every object of a loadbalancer tree."""
+
+    objects = {'loadbalancer:%s' % lb_dict['id']: _own_fields(lb_dict)}
+    for listener in lb_dict.get('listeners') or []:
+        objects['listener:%s' % listener['id']] = _own_fields(listener)
+        for policy in listener.get('l7_policies') or []:
+            policy_dict = _own_fields(policy)
+            policy_dict['rules'] = sorted(
+                (_own_fields(rule) for rule in policy.get('rules') or []),
+                key=lambda rule: rule['id'])
+            objects['l7policy:%s' % policy['id']] = policy_dict
+    for pool in lb_dict.get('pools') or []:
+        objects['pool:%s' % pool['id']] = _own_fields(pool)
+        for member in pool.get('members') or []:
+            objects['member:%s' % member['id']] = _own_fields(member)
+        if pool.get('healthmonitor'):
+            hm = pool['healthmonitor']
+            objects['hm:%s' % hm['id']] = _own_fields(hm)
+    return objects
+
+
+def object_digests(objects):
+    """Map the keys of split_loadbalancer() output to content hashes."""
+    return dict((key, content_hash(obj)) for key, obj in objects.items())
+
+
+def diff_digests(ours, theirs):
+    """Return (changed keys, removed keys) to bring theirs in line."""
+    changed = [key for key, value in ours.items()
+               if theirs.get(key) != value]
+    removed = [key for key in theirs if key not in ours]
+    return changed, removed
+
+
+def compact_digest(digests):
+    """Fold the digests of a loadbalancer into a single value.
+
+    The value does not depend on the order of the objects, so agents can
+    compute it the same way from whatever they hold.
+    """
+    folded = 0
+    for key, value in digests.items():
+        folded ^= int(content_hash([key, value])[:16], 16)
+    return '%016x' % folded
+
+
+class ArrayObjectDigest(BASE):
+    __tablename__ = 'array_object_digests'
+
+    loadbalancer_id = sa.Column(sa.String(36), primary_key=True)
+    obj_key = sa.Column(sa.String(64), primary_key=True)
+    digest = sa.Column(sa.String(40), nullable=False)
+
+
+class DigestStore(object):
+    """Object digests of the loadbalancers, maintained as they change.
+
+    The digests live in the array_object_digests table, so the changes
+    made by any neutron-server process are seen by the reconciliation
+    running in another one. Only loadbalancers whose digests were
+    computed from a full tree once are tracked, i.e. hold the row of
+    their loadbalancer key; changes to other loadbalancers are ignored
+    until then.
+    """
+
+    def start(self):
+        context = ncontext.get_admin_context()
+        BASE.metadata.create_all(context.session.get_bind(),
+                                 checkfirst=True)
+
+    @staticmethod
+    def _query(session, loadbalancer_id):
+        return session.query(ArrayObjectDigest).filter_by(
+            loadbalancer_id=loadbalancer_id)
+
+    def get(self, loadbalancer_id):
+        session = ncontext.get_admin_context().session
+        digests = dict((row.obj_key, row.digest) for row in
+                       self._query(session, loadbalancer_id))
+        if 'loadbalancer:%s' % loadbalancer_id not in digests:
+            return None
+        return digests
+
+    def set(self, loadbalancer_id, digests):
+        session = ncontext.get_admin_context().session
+        with session.begin(subtransactions=True):
+            self._query(session, loadbalancer_id).delete(
+                synchronize_session=False)
+            session.add_all(ArrayObjectDigest(loadbalancer_id=loadbalancer_id,
+                                              obj_key=key, digest=value)
+                            for key, value in digests.items())
+
+    def update(self, loadbalancer_id, key, obj_dict):
+        value = content_hash(_own_fields(obj_dict))
+        session = ncontext.get_admin_context().session
+        with session.begin(subtransactions=True):
+            query = self._query(session, loadbalancer_id)
+            if query.filter_by(obj_key=key).update(
+                    {'digest': value}, synchronize_session=False):
+                return
+            if query.filter_by(
+                    obj_key='loadbalancer:%s' % loadbalancer_id).count():
+                session.add(ArrayObjectDigest(
+                    loadbalancer_id=loadbalancer_id, obj_key=key,
+                    digest=value))
+
+    def remove(self, loadbalancer_id, key):
+        session = ncontext.get_admin_context().session
+        with session.begin(subtransactions=True):
+            self._query(session, loadbalancer_id).filter_by(
+                obj_key=key).delete(synchronize_session=False)
+
+    def invalidate(self, loadbalancer_id):
+        session = ncontext.get_admin_context().session
+        with session.begin(subtransactions=True):
+            self._query(session, loadbalancer_id).delete(
+                synchronize_session=False)
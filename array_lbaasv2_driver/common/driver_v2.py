@@ -11,25 +11,39 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import collections
 import sys
+import threading
+import time
 
 from oslo_config import cfg
 from oslo_log import helpers as log_helpers
 from oslo_log import log as logging
+from oslo_service import loopingcall
 from oslo_utils import importutils
 
 from neutron.common import rpc as n_rpc
 from neutron.db import agents_db
 from neutron.plugins.common import constants as plugin_constants
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
 from neutron_lib import constants as lb_const
+from neutron_lib import context as ncontext
 
+from neutron_lbaas.agent_scheduler import LoadbalancerAgentBinding
 from neutron_lbaas.db.loadbalancer import models
 from neutron_lbaas.extensions import lbaas_agentschedulerv2
 
 from array_lbaasv2_driver.common import plugin_rpc
 from array_lbaasv2_driver.common import agent_rpc
+from array_lbaasv2_driver.common import cache
 from array_lbaasv2_driver.common import constants_v2
+from array_lbaasv2_driver.common import db
+from array_lbaasv2_driver.common import digest
 from array_lbaasv2_driver.common import exceptions as array_exc
+from array_lbaasv2_driver.common import port_pool
+from array_lbaasv2_driver.common import workers
 
 LOG = logging.getLogger(__name__)
 
@@ -40,12 +54,63 @@ OPTS = [
             'neutron_lbaas.agent_scheduler.ChanceScheduler'
         ),
         help=('Driver to use for scheduling '
-              'pool to a default loadbalancer agent')
+              'pool to a default loadbalancer agent. '
+              'array_lbaasv2_driver.common.scheduler.'
+              'ArrayLoadBalancerScheduler places loadbalancers on the '
+              'least loaded agent')
     )
 ]
 
 cfg.CONF.register_opts(OPTS)
 
+DRIVER_OPTS = [
+    cfg.IntOpt(
+        'array_binding_cache_ttl',
+        default=300,
+        help=('Seconds a loadbalancer to agent binding is served from the '
+              'in-process cache before the scheduler is asked again. '
+              '0 disables the cache')
+    ),
+    cfg.IntOpt(
+        'array_binding_cache_size',
+        default=10000,
+        help=('Maximum number of loadbalancer to agent bindings kept in '
+              'the in-process cache')
+    ),
+    cfg.IntOpt(
+        'array_agent_check_interval',
+        default=30,
+        help=('Interval in seconds to look for dead or disabled agents, '
+              'drop their cached bindings and refresh the agent hosts '
+              'used for routing. Each neutron-server process checks on '
+              'its first agent lookup after the interval. 0 disables '
+              'the check')
+    ),
+    cfg.IntOpt(
+        'array_callback_workers',
+        default=0,
+        help=('Number of workers processing agent completion callbacks. '
+              'Callbacks of one loadbalancer are handled in order by the '
+              'same worker. 0 handles them in the RPC consumer thread')
+    ),
+    cfg.IntOpt(
+        'array_reconcile_interval',
+        default=0,
+        help=('Interval in seconds between two batches of the drift '
+              'reconciliation, which compares the configuration of '
+              'active loadbalancers with what their agent holds and '
+              'refreshes those that diverge. 0 disables it')
+    ),
+    cfg.IntOpt(
+        'array_reconcile_batch_size',
+        default=100,
+        help=('Number of loadbalancers compared with their agents per '
+              'reconciliation batch')
+    )
+]
+
+cfg.CONF.register_opts(DRIVER_OPTS, "arraynetworks")
+
 
 class ArrayDriverV2(object):
     """Array Networks LBaaSv2 Driver."""
@@ -71,18 +136,270 @@ class ArrayDriverV2(object):
         self.scheduler = importutils.import_object(
             cfg.CONF.loadbalancer_scheduler_driver)
 
+        self.binding_cache = None
+        if cfg.CONF.arraynetworks.array_binding_cache_ttl > 0:
+            self.binding_cache = cache.LRUCache(
+                cfg.CONF.arraynetworks.array_binding_cache_size,
+                ttl=cfg.CONF.arraynetworks.array_binding_cache_ttl)
+
         self.agent_rpc = agent_rpc.LBaaSv2AgentRPC(self)
 
+        self.callback_workers = None
+        if cfg.CONF.arraynetworks.array_callback_workers > 0:
+            self.callback_workers = workers.PartitionedWorkerPool(
+                'array-callbacks',
+                cfg.CONF.arraynetworks.array_callback_workers)
+
+        self.callbacks = plugin_rpc.ArrayLoadBalancerCallbacks(
+            driver, self.callback_workers)
+
+        self.vip_port_pool = None
+        if cfg.CONF.arraynetworks.array_vip_port_pool:
+            self.vip_port_pool = port_pool.VipPortPool(
+                self.callbacks.create_ports_on_subnet,
+                lambda: self.plugin.db._core_plugin)
+            self.vip_port_pool.start()
+            self.callbacks.vip_port_pool = self.vip_port_pool
         self.agent_endpoints = [
-            plugin_rpc.ArrayLoadBalancerCallbacks(driver),
+            self.callbacks,
             agents_db.AgentExtRpcCallback(self.plugin.db)
         ]
 
         self.plugin.agent_notifiers.update(
             {lb_const.AGENT_TYPE_LOADBALANCER: self.agent_rpc})
 
+        db.subscribe_port_events()
+
         self.start_rpc_listeners()
 
+        self._agents_checked = 0
+        self._agent_check_lock = threading.Lock()
+
+        registry.subscribe(self._start_process, resources.PROCESS,
+                           events.AFTER_INIT)
+
+        self.digests = None
+        self._reconciler = None
+        self._reconcile_marker = None
+        interval = cfg.CONF.arraynetworks.array_reconcile_interval
+        if interval > 0:
+            self.digests = digest.DigestStore()
+            self.digests.start()
+            self._reconciler = loopingcall.FixedIntervalLoopingCall(
+                self._reconcile)
+            self._reconciler.start(interval=interval, initial_delay=interval)
+
+    def _start_process(self, resource, event, trigger, **kwargs):
+        """Start the threads of a forked neutron-server worker.
+
+        The driver is loaded before the workers are forked and the
+        threads started meanwhile only run in the parent. The outbox and
+        the reconciliation work from the database and stay there, the
+        ones serving this process' own state are started again.
+        """
+        self.agent_rpc.start_workers()
+        if self.callback_workers is not None:
+            self.callback_workers.start()
+        if self.vip_port_pool is not None:
+            self.vip_port_pool.start_reclaimer()
+
+    def schedule_agent(self, context, loadbalancer):
+        """Return the agent hosting loadbalancer, scheduling it if needed.
+
+        Bindings are served from the binding cache when it is enabled, so
+        child object operations do not query the agent binding tables.
+        """
+
+        self.check_agents()
+        if self.binding_cache is not None:
+            agent = self.binding_cache.get(loadbalancer.id)
+            if agent is not None:
+                return agent
+
+        agent = self.scheduler.schedule(
+            self.plugin,
+            context,
+            loadbalancer,
+            "array"
+        )
+        if agent is None:
+            # ChanceScheduler returns nothing for an already bound
+            # loadbalancer, look the binding up instead
+            return self.get_hosting_agent(context, loadbalancer.id)
+        return self._cache_binding(loadbalancer.id, agent)
+
+    def get_hosting_agent(self, context, loadbalancer_id):
+        """Return the agent bound to loadbalancer_id without scheduling."""
+
+        self.check_agents()
+        if self.binding_cache is not None:
+            agent = self.binding_cache.get(loadbalancer_id)
+            if agent is not None:
+                return agent
+
+        hosting = self.plugin.db.get_agent_hosting_loadbalancer(
+            context, loadbalancer_id)
+        if not hosting:
+            return None
+        return self._cache_binding(loadbalancer_id, hosting['agent'])
+
+    def _cache_binding(self, loadbalancer_id, agent):
+        if self.binding_cache is None:
+            return agent
+        # keep primitives only, agent may be a session bound model
+        agent = {'id': agent['id'], 'host': agent['host']}
+        self.binding_cache.set(loadbalancer_id, agent)
+        return agent
+
+    def get_agent_host(self, context, loadbalancer_id):
+        agent = self.get_hosting_agent(context, loadbalancer_id)
+        return agent['host'] if agent else None
+
+    def invalidate_loadbalancer_binding(self, loadbalancer_id):
+        if self.binding_cache is not None:
+            self.binding_cache.pop(loadbalancer_id)
+
+    def invalidate_agent_bindings(self, host):
+        if self.binding_cache is not None:
+            dropped = self.binding_cache.purge(
+                lambda lb_id, agent: agent['host'] == host)
+            if dropped:
+                LOG.info("Dropped %d cached bindings of agent %s" %
+                         (dropped, host))
+
+    def get_binding_cache_stats(self):
+        if self.binding_cache is None:
+            return {}
+        return self.binding_cache.stats()
+
+    def get_vlan_cache_stats(self):
+        return db.get_vlan_cache_stats()
+
+    def get_neutron_cache_stats(self):
+        return self.callbacks.get_cache_stats()
+
+    def get_callback_queue_stats(self):
+        if self.callback_workers is None:
+            return {}
+        return self.callback_workers.stats()
+
+    def get_dispatch_queue_stats(self):
+        return self.agent_rpc.get_dispatch_stats()
+
+    def get_outbox_stats(self):
+        return self.agent_rpc.get_outbox_stats()
+
+    def check_agents(self):
+        """Look for dead agents once per array_agent_check_interval.
+
+        Runs in the process asking, so each neutron-server worker keeps
+        its own binding cache and routing ring current. One caller does
+        the lookup, the others carry on with the current state.
+        """
+        interval = cfg.CONF.arraynetworks.array_agent_check_interval
+        if interval <= 0 or time.time() < self._agents_checked + interval:
+            return
+        if not self._agent_check_lock.acquire(False):
+            return
+        try:
+            if time.time() >= self._agents_checked + interval:
+                self._check_agents()
+                self._agents_checked = time.time()
+        finally:
+            self._agent_check_lock.release()
+
+    def _check_agents(self):
+        try:
+            context = ncontext.get_admin_context()
+            live_hosts = []
+            for agent in self.plugin.db.get_lbaas_agents(context):
+                if (not agent['admin_state_up'] or
+                        agents_db.AgentDbMixin.is_agent_down(
+                            agent['heartbeat_timestamp'])):
+                    self.invalidate_agent_bindings(agent['host'])
+                else:
+                    live_hosts.append(agent['host'])
+            self.agent_rpc.set_agent_hosts(live_hosts)
+        except Exception as e:
+            LOG.error("Exception: check agents: %s" % e)
+
+    def _next_reconcile_batch(self, context):
+        """Return the next (loadbalancer id, agent host) pairs to check.
+
+        Batches walk the active loadbalancers in id order, the walk starts
+        over once the last one was returned.
+        """
+
+        query = (context.session.query(
+            LoadbalancerAgentBinding.loadbalancer_id, agents_db.Agent.host).
+            join(models.LoadBalancer, models.LoadBalancer.id ==
+                 LoadbalancerAgentBinding.loadbalancer_id).
+            join(agents_db.Agent, agents_db.Agent.id ==
+                 LoadbalancerAgentBinding.agent_id).
+            filter(models.LoadBalancer.provisioning_status ==
+                   plugin_constants.ACTIVE))
+        if self._reconcile_marker:
+            query = query.filter(LoadbalancerAgentBinding.loadbalancer_id >
+                                 self._reconcile_marker)
+        batch = query.order_by(
+            LoadbalancerAgentBinding.loadbalancer_id).limit(
+            cfg.CONF.arraynetworks.array_reconcile_batch_size).all()
+        self._reconcile_marker = batch[-1][0] if batch else None
+        return batch
+
+    def _get_digests(self, context, loadbalancer_id):
+        digests = self.digests.get(loadbalancer_id)
+        if digests is None:
+            loadbalancer = self.plugin.db.get_loadbalancer(
+                context, loadbalancer_id)
+            digests = digest.object_digests(digest.split_loadbalancer(
+                agent_rpc.DataModelSerializer.to_dict(loadbalancer)))
+            self.digests.set(loadbalancer_id, digests)
+        return digests
+
+    def _reconcile(self):
+        if not self.agent_rpc.can_refresh():
+            return
+        try:
+            context = ncontext.get_admin_context()
+            by_host = collections.defaultdict(list)
+            for lb_id, host in self._next_reconcile_batch(context):
+                by_host[host].append(lb_id)
+
+            for host, lb_ids in by_host.items():
+                try:
+                    reported = self.agent_rpc.get_loadbalancer_digests(
+                        context, lb_ids, host, compact=True) or {}
+                except Exception as e:
+                    LOG.warning("Unable to get digests from %s: %s" %
+                                (host, e))
+                    continue
+                for lb_id in lb_ids:
+                    ours = digest.compact_digest(
+                        self._get_digests(context, lb_id))
+                    if reported.get(lb_id) != ours:
+                        LOG.info("Loadbalancer %s drifted on %s" %
+                                 (lb_id, host))
+                        self._queue_repair(lb_id)
+        except Exception as e:
+            LOG.error("Exception: reconcile: %s" % e)
+
+    def _queue_repair(self, loadbalancer_id):
+        if self.callback_workers is not None:
+            self.callback_workers.submit(
+                loadbalancer_id, self._repair, loadbalancer_id)
+        else:
+            self._repair(loadbalancer_id)
+
+    def _repair(self, loadbalancer_id):
+        try:
+            context = ncontext.get_admin_context()
+            loadbalancer = self.plugin.db.get_loadbalancer(
+                context, loadbalancer_id)
+            self.loadbalancer.refresh(context, loadbalancer)
+        except Exception as e:
+            LOG.error("Exception: repair %s: %s" % (loadbalancer_id, e))
+
     def start_rpc_listeners(self):
         # other agent based plugin driver might already set callbacks on plugin
         if hasattr(self.plugin, 'agent_callbacks'):
@@ -100,20 +417,52 @@ class ArrayDriverV2(object):
         pass
 
 class BaseManager(object):
-    '''Parent for all managers defined in this module.'''
+    '''Parent for all managers defined in this module.
+
+    Managers are shared by all API workers, so they keep no per-operation
+    state: the loadbalancer and payload of an operation are passed along
+    explicitly.
+    '''
+
+    # prefix of the digest keys of the managed objects, None when a change
+    # invalidates the digests of the whole loadbalancer
+    digest_kind = None
+    # whether deleting an object also deletes others, which invalidates
+    # the digests of the whole loadbalancer
+    digest_cascades = False
 
     def __init__(self, driver):
         self.driver = driver
-        self.api_dict = None
-        self.loadbalancer = None
 
-    def _call_rpc(self, context, entity, rpc_method):
+    def _track_digest(self, loadbalancer, obj_dict, deleted=False):
+        '''Apply a change sent to the agent to the digest store.'''
+
+        store = self.driver.digests
+        if store is None:
+            return
+        try:
+            if self.digest_kind is None or (deleted and
+                                            self.digest_cascades):
+                store.invalidate(loadbalancer.id)
+                return
+            key = '%s:%s' % (self.digest_kind, obj_dict['id'])
+            if deleted:
+                store.remove(loadbalancer.id, key)
+            else:
+                store.update(loadbalancer.id, key, obj_dict)
+        except Exception as e:
+            # the cast is out, a stale digest only costs a refresh
+            LOG.error("Exception: digest of %s: %s" % (loadbalancer.id, e))
+
+    def _call_rpc(self, context, loadbalancer, entity, api_dict, rpc_method):
         '''Perform operations common to create and delete for managers.'''
 
         try:
-            agent_host = self._setup_crud(context, entity)
+            agent_host = self._setup_crud(context, loadbalancer, entity)
             rpc_callable = getattr(self.driver.agent_rpc, rpc_method)
-            rpc_callable(context, self.api_dict, agent_host)
+            rpc_callable(context, api_dict, agent_host)
+            self._track_digest(loadbalancer, api_dict,
+                               deleted=rpc_method.startswith('delete_'))
         except (lbaas_agentschedulerv2.NoEligibleLbaasAgent,
                 lbaas_agentschedulerv2.NoActiveLbaasAgent) as e:
             LOG.error("Exception: %s: %s" % (rpc_method, e))
@@ -121,17 +470,18 @@ class BaseManager(object):
             LOG.error("Exception: %s: %s" % (rpc_method, e))
             raise e
 
-    def _setup_crud(self, context, entity):
+    def _setup_crud(self, context, loadbalancer, entity):
         '''Setup CRUD operations for managers to make calls to agent.
 
         :param context: auth context for performing CRUD operation
+        :param loadbalancer: loadbalancer the entity belongs to
         :param entity: neutron lbaas entity -- target of the CRUD operation
-        :returns: tuple -- (agent object, service dict)
+        :returns: host of the agent, None if no agent is available
         :raises: ArrayNoAttachedLoadbalancerException
         '''
 
-        if entity.attached_to_loadbalancer() and self.loadbalancer:
-            agent = self._schedule_agent_create_service(context)
+        if entity.attached_to_loadbalancer() and loadbalancer:
+            agent = self._schedule_agent_create_service(context, loadbalancer)
             if agent is None:
                 return None
             else:
@@ -139,32 +489,29 @@ class BaseManager(object):
 
         raise array_exc.ArrayNoAttachedLoadbalancerException()
 
-    def _schedule_agent_create_service(self, context):
+    def _schedule_agent_create_service(self, context, loadbalancer):
         '''Schedule agent and build service--used for most managers.
 
         :param context: auth context for performing crud operation
+        :param loadbalancer: loadbalancer to schedule
         :returns: agent object
         '''
 
-        agent = self.driver.scheduler.schedule(
-            self.driver.plugin,
-            context,
-            self.loadbalancer,
-            "array"
-        )
-        return agent
+        return self.driver.schedule_agent(context, loadbalancer)
 
 
 class LoadBalancerManager(BaseManager):
     """LoadBalancerManager class handles Neutron LBaaS CRUD."""
 
+    digest_kind = 'loadbalancer'
+    digest_cascades = True
+
     @log_helpers.log_method_call
     def create(self, context, loadbalancer):
         """Create a loadbalancer."""
         driver = self.driver
-        self.loadbalancer = loadbalancer
         try:
-            agent = self._schedule_agent_create_service(context)
+            agent = self._schedule_agent_create_service(context, loadbalancer)
 
             driver.agent_rpc.create_loadbalancer(
                 context, loadbalancer, agent['host'])
@@ -184,14 +531,16 @@ class LoadBalancerManager(BaseManager):
     def update(self, context, old_loadbalancer, loadbalancer):
         """Update a loadbalancer."""
         driver = self.driver
-        self.loadbalancer = loadbalancer
         try:
             driver.agent_rpc.update_loadbalancer(
                 context,
                 old_loadbalancer,
                 loadbalancer,
-                None
+                driver.get_agent_host(context, loadbalancer.id)
             )
+            self._track_digest(
+                loadbalancer,
+                agent_rpc.DataModelSerializer.to_dict(loadbalancer))
         except (lbaas_agentschedulerv2.NoEligibleLbaasAgent,
                 lbaas_agentschedulerv2.NoActiveLbaasAgent) as e:
             LOG.error("Exception: loadbalancer update: %s" % e)
@@ -207,10 +556,12 @@ class LoadBalancerManager(BaseManager):
     def delete(self, context, loadbalancer):
         """Delete a loadbalancer."""
         driver = self.driver
-        self.loadbalancer = loadbalancer
         try:
+            agent_host = driver.get_agent_host(context, loadbalancer.id)
+            driver.invalidate_loadbalancer_binding(loadbalancer.id)
             driver.agent_rpc.delete_loadbalancer(
-                context, loadbalancer, None)
+                context, loadbalancer, agent_host)
+            self._track_digest(loadbalancer, None, deleted=True)
 
         except (lbaas_agentschedulerv2.NoEligibleLbaasAgent,
                 lbaas_agentschedulerv2.NoActiveLbaasAgent) as e:
@@ -220,10 +571,101 @@ class LoadBalancerManager(BaseManager):
             LOG.error("Exception: loadbalancer delete: %s" % e)
             raise e
 
+    @log_helpers.log_method_call
+    def delete_cascade(self, context, loadbalancer):
+        """Delete a loadbalancer along with all its children.
+
+        The whole tree goes to the agent in a single cast. Agents that do
+        not support it get one delete per object, children first.
+
+        This is an API for out-of-tree callers only: the neutron-lbaas v2
+        plugin never calls delete_cascade on its drivers and refuses to
+        delete a loadbalancer that still has children.
+        """
+        driver = self.driver
+        try:
+            agent_host = driver.get_agent_host(context, loadbalancer.id)
+            driver.invalidate_loadbalancer_binding(loadbalancer.id)
+            if driver.agent_rpc.can_delete_cascade():
+                driver.agent_rpc.delete_loadbalancer_cascade(
+                    context, loadbalancer, agent_host)
+            else:
+                self._delete_tree(context, loadbalancer, agent_host)
+            self._track_digest(loadbalancer, None, deleted=True)
+
+        except (lbaas_agentschedulerv2.NoEligibleLbaasAgent,
+                lbaas_agentschedulerv2.NoActiveLbaasAgent) as e:
+            LOG.error("Exception: loadbalancer delete cascade: %s" % e)
+            driver.plugin.db.delete_loadbalancer(context, loadbalancer.id)
+        except Exception as e:
+            LOG.error("Exception: loadbalancer delete cascade: %s" % e)
+            raise e
+
+    def _delete_tree(self, context, loadbalancer, agent_host):
+        rpc = self.driver.agent_rpc
+        tree = agent_rpc.DataModelSerializer.to_dict(loadbalancer)
+        listeners = tree.get('listeners') or []
+        for listener in listeners:
+            for policy in listener.get('l7_policies') or []:
+                for rule in policy.get('rules') or []:
+                    rpc.delete_l7rule(context, rule, agent_host)
+                rpc.delete_l7policy(context, policy, agent_host)
+        for pool in tree.get('pools') or []:
+            for member in pool.get('members') or []:
+                rpc.delete_member(context, member, agent_host)
+            if pool.get('healthmonitor'):
+                rpc.delete_health_monitor(
+                    context, pool['healthmonitor'], agent_host)
+            rpc.delete_pool(context, pool, agent_host)
+        for listener in listeners:
+            rpc.delete_listener(context, listener, agent_host)
+        rpc.delete_loadbalancer(context, loadbalancer, agent_host)
+
     @log_helpers.log_method_call
     def refresh(self, context, loadbalancer):
-        """Refresh a loadbalancer."""
-        pass
+        """Refresh a loadbalancer.
+
+        Only the objects whose digest differs from the one reported by
+        the hosting agent are sent, along with the keys of the objects the
+        agent holds but the database does not. When the agent cannot
+        report digests every object is sent.
+        """
+        driver = self.driver
+        if not driver.agent_rpc.can_refresh():
+            LOG.debug("Agents do not support refresh, skipping %s" %
+                      loadbalancer.id)
+            return
+
+        try:
+            agent_host = driver.get_agent_host(context, loadbalancer.id)
+            objects = digest.split_loadbalancer(
+                agent_rpc.DataModelSerializer.to_dict(loadbalancer))
+            ours = digest.object_digests(objects)
+            if driver.digests is not None:
+                driver.digests.set(loadbalancer.id, ours)
+            theirs = {}
+            if agent_host:
+                try:
+                    reported = driver.agent_rpc.get_loadbalancer_digests(
+                        context, [loadbalancer.id], agent_host)
+                    theirs = (reported or {}).get(loadbalancer.id) or {}
+                except Exception as e:
+                    LOG.warning("Unable to get digests of %s, sending "
+                                "every object: %s" % (loadbalancer.id, e))
+            changed, removed = digest.diff_digests(ours, theirs)
+            if not changed and not removed:
+                return
+
+            lb_key = 'loadbalancer:%s' % loadbalancer.id
+            driver.agent_rpc.refresh_loadbalancer(
+                context,
+                objects[lb_key],
+                dict((key, objects[key]) for key in changed),
+                removed,
+                agent_host)
+        except Exception as e:
+            LOG.error("Exception: loadbalancer refresh: %s" % e)
+            raise e
 
     @log_helpers.log_method_call
     def stats(self, context, loadbalancer):
@@ -232,7 +674,7 @@ class LoadBalancerManager(BaseManager):
             driver.agent_rpc.update_loadbalancer_stats(
                 context,
                 loadbalancer,
-                None
+                driver.get_agent_host(context, loadbalancer.id)
             )
         except (lbaas_agentschedulerv2.NoEligibleLbaasAgent,
                 lbaas_agentschedulerv2.NoActiveLbaasAgent) as e:
@@ -249,29 +691,35 @@ class LoadBalancerManager(BaseManager):
 class ListenerManager(BaseManager):
     """ListenerManager class handles Neutron LBaaS listener CRUD."""
 
+    digest_kind = 'listener'
+    digest_cascades = True
+
     @log_helpers.log_method_call
     def create(self, context, listener):
         """Create a listener."""
 
-        self.loadbalancer = listener.loadbalancer
-        self.api_dict = listener.to_dict()
-        LOG.debug("create listener: --%s--" % self.api_dict)
-        self._call_rpc(context, listener, 'create_listener')
+        loadbalancer = listener.loadbalancer
+        api_dict = listener.to_dict()
+        LOG.debug("create listener: --%s--" % api_dict)
+        self._call_rpc(context, loadbalancer, listener, api_dict,
+                       'create_listener')
 
     @log_helpers.log_method_call
     def update(self, context, old_listener, listener):
         """Update a listener."""
 
         driver = self.driver
-        self.loadbalancer = listener.loadbalancer
+        loadbalancer = listener.loadbalancer
         try:
-            agent_host = self._setup_crud(context, listener)
+            agent_host = self._setup_crud(context, loadbalancer, listener)
+            api_dict = listener.to_dict()
             driver.agent_rpc.update_listener(
                 context,
                 old_listener.to_dict(),
-                listener.to_dict(),
+                api_dict,
                 agent_host
             )
+            self._track_digest(loadbalancer, api_dict)
         except Exception as e:
             LOG.error("Exception: listener update: %s" % e.message)
             raise e
@@ -280,15 +728,19 @@ class ListenerManager(BaseManager):
     def delete(self, context, listener):
         """Delete a listener."""
 
-        self.loadbalancer = listener.loadbalancer
-        self.api_dict = listener.to_dict()
-        LOG.debug("create listener: --%s--" % self.api_dict)
-        self._call_rpc(context, listener, 'delete_listener')
+        loadbalancer = listener.loadbalancer
+        api_dict = listener.to_dict()
+        LOG.debug("create listener: --%s--" % api_dict)
+        self._call_rpc(context, loadbalancer, listener, api_dict,
+                       'delete_listener')
 
 
 class PoolManager(BaseManager):
     """PoolManager class handles Neutron LBaaS pool CRUD."""
 
+    digest_kind = 'pool'
+    digest_cascades = True
+
     def _get_pool_dict(self, pool):
         pool_dict = pool.to_dict(
             listeners=False,
@@ -303,24 +755,26 @@ class PoolManager(BaseManager):
     def create(self, context, pool):
         """Create a pool."""
 
-        self.loadbalancer = pool.loadbalancer
-        self.api_dict = self._get_pool_dict(pool)
-        self._call_rpc(context, pool, 'create_pool')
+        loadbalancer = pool.loadbalancer
+        api_dict = self._get_pool_dict(pool)
+        self._call_rpc(context, loadbalancer, pool, api_dict, 'create_pool')
 
     @log_helpers.log_method_call
     def update(self, context, old_pool, pool):
         """Update a pool."""
 
         driver = self.driver
-        self.loadbalancer = pool.loadbalancer
+        loadbalancer = pool.loadbalancer
         try:
-            agent_host = self._setup_crud(context, pool)
+            agent_host = self._setup_crud(context, loadbalancer, pool)
+            api_dict = self._get_pool_dict(pool)
             driver.agent_rpc.update_pool(
                 context,
                 self._get_pool_dict(old_pool),
-                self._get_pool_dict(pool),
+                api_dict,
                 agent_host
             )
+            self._track_digest(loadbalancer, api_dict)
         except Exception as e:
             LOG.error("Exception: pool update: %s" % e.message)
             raise e
@@ -329,14 +783,16 @@ class PoolManager(BaseManager):
     def delete(self, context, pool):
         """Delete a pool."""
 
-        self.loadbalancer = pool.loadbalancer
-        self.api_dict = self._get_pool_dict(pool)
-        self._call_rpc(context, pool, 'delete_pool')
+        loadbalancer = pool.loadbalancer
+        api_dict = self._get_pool_dict(pool)
+        self._call_rpc(context, loadbalancer, pool, api_dict, 'delete_pool')
 
 
 class MemberManager(BaseManager):
     """MemberManager class handles Neutron LBaaS pool member CRUD."""
 
+    digest_kind = 'member'
+
     def _get_member_dict(self, member):
         member_dict = member.to_dict(
             listener=False,
@@ -351,25 +807,28 @@ class MemberManager(BaseManager):
     def create(self, context, member):
         """Create a member."""
 
-        self.loadbalancer = member.pool.loadbalancer
-        self.api_dict = self._get_member_dict(member)
-        LOG.debug("create member: --%s--" % self.api_dict)
-        self._call_rpc(context, member, 'create_member')
+        loadbalancer = member.pool.loadbalancer
+        api_dict = self._get_member_dict(member)
+        LOG.debug("create member: --%s--" % api_dict)
+        self._call_rpc(context, loadbalancer, member, api_dict,
+                       'create_member')
 
     @log_helpers.log_method_call
     def update(self, context, old_member, member):
         """Update a member."""
 
         driver = self.driver
-        self.loadbalancer = member.pool.loadbalancer
+        loadbalancer = member.pool.loadbalancer
         try:
-            agent_host = self._setup_crud(context, member)
+            agent_host = self._setup_crud(context, loadbalancer, member)
+            api_dict = self._get_member_dict(member)
             driver.agent_rpc.update_member(
                 context,
                 self._get_member_dict(old_member),
-                self._get_member_dict(member),
+                api_dict,
                 agent_host
             )
+            self._track_digest(loadbalancer, api_dict)
         except Exception as e:
             LOG.error("Exception: member update: %s" % e.message)
             raise e
@@ -377,20 +836,85 @@ class MemberManager(BaseManager):
     @log_helpers.log_method_call
     def delete(self, context, member):
         """Delete a member."""
-        self.loadbalancer = member.pool.loadbalancer
+        loadbalancer = member.pool.loadbalancer
         driver = self.driver
         try:
-            agent_host = self._setup_crud(context, member)
-            driver.agent_rpc.delete_member(
-                context, self._get_member_dict(member), agent_host)
+            agent_host = self._setup_crud(context, loadbalancer, member)
+            api_dict = self._get_member_dict(member)
+            driver.agent_rpc.delete_member(context, api_dict, agent_host)
+            self._track_digest(loadbalancer, api_dict, deleted=True)
         except Exception as e:
             LOG.error("Exception: member delete: %s" % e.message)
             raise e
 
+    @log_helpers.log_method_call
+    def create_members(self, context, members):
+        """Create a batch of members."""
+
+        for loadbalancer, batch in self._group_by_loadbalancer(members):
+            self._call_batch_rpc(
+                context, loadbalancer, batch, 'create_members',
+                [self._get_member_dict(member) for member in batch])
+
+    @log_helpers.log_method_call
+    def update_members(self, context, old_members, members):
+        """Update a batch of members."""
+
+        old_by_id = dict((member.id, member) for member in old_members)
+        for loadbalancer, batch in self._group_by_loadbalancer(members):
+            self._call_batch_rpc(
+                context, loadbalancer, batch, 'update_members',
+                [self._get_member_dict(old_by_id[member.id])
+                 for member in batch],
+                [self._get_member_dict(member) for member in batch])
+
+    @log_helpers.log_method_call
+    def delete_members(self, context, members):
+        """Delete a batch of members."""
+
+        for loadbalancer, batch in self._group_by_loadbalancer(members):
+            self._call_batch_rpc(
+                context, loadbalancer, batch, 'delete_members',
+                [self._get_member_dict(member) for member in batch])
+
+    def _group_by_loadbalancer(self, members):
+        '''Split members into per-loadbalancer batches, keeping order.'''
+
+        batches = collections.OrderedDict()
+        for member in members:
+            loadbalancer = member.pool.loadbalancer
+            if loadbalancer.id not in batches:
+                batches[loadbalancer.id] = (loadbalancer, [])
+            batches[loadbalancer.id][1].append(member)
+        return list(batches.values())
+
+    def _call_batch_rpc(self, context, loadbalancer, members, rpc_method,
+                        *api_dicts):
+        '''Schedule once for the whole batch and send a single cast.'''
+
+        try:
+            for member in members:
+                if not member.attached_to_loadbalancer():
+                    raise array_exc.ArrayNoAttachedLoadbalancerException()
+            agent_host = self._setup_crud(context, loadbalancer, members[0])
+            rpc_callable = getattr(self.driver.agent_rpc, rpc_method)
+            rpc_callable(context, *(api_dicts + (agent_host,)))
+            for api_dict in api_dicts[-1]:
+                self._track_digest(loadbalancer, api_dict,
+                                   deleted=rpc_method.startswith('delete_'))
+        except (lbaas_agentschedulerv2.NoEligibleLbaasAgent,
+                lbaas_agentschedulerv2.NoActiveLbaasAgent) as e:
+            LOG.error("Exception: %s: %s" % (rpc_method, e))
+        except Exception as e:
+            LOG.error("Exception: %s: %s" % (rpc_method, e))
+            raise e
+
 
 class HealthMonitorManager(BaseManager):
     """HealthMonitorManager class handles Neutron LBaaS monitor CRUD."""
 
+    digest_kind = 'hm'
+
     def _get_hm_dict(self, hm):
         hm_dict = hm.to_dict(
             listener=False,
@@ -405,24 +929,28 @@ class HealthMonitorManager(BaseManager):
     def create(self, context, health_monitor):
         """Create a health monitor."""
 
-        self.loadbalancer = health_monitor.pool.loadbalancer
-        self.api_dict = self._get_hm_dict(health_monitor)
-        self._call_rpc(context, health_monitor, 'create_health_monitor')
+        loadbalancer = health_monitor.pool.loadbalancer
+        api_dict = self._get_hm_dict(health_monitor)
+        self._call_rpc(context, loadbalancer, health_monitor, api_dict,
+                       'create_health_monitor')
 
     @log_helpers.log_method_call
     def update(self, context, old_health_monitor, health_monitor):
         """Update a health monitor."""
 
         driver = self.driver
-        self.loadbalancer = health_monitor.pool.loadbalancer
+        loadbalancer = health_monitor.pool.loadbalancer
         try:
-            agent_host = self._setup_crud(context, health_monitor)
+            agent_host = self._setup_crud(context, loadbalancer,
+                                          health_monitor)
+            api_dict = self._get_hm_dict(health_monitor)
             driver.agent_rpc.update_health_monitor(
                 context,
                 self._get_hm_dict(old_health_monitor),
-                self._get_hm_dict(health_monitor),
+                api_dict,
                 agent_host
             )
+            self._track_digest(loadbalancer, api_dict)
         except Exception as e:
             LOG.error("Exception: health monitor update: %s" % e.message)
             raise e
@@ -431,36 +959,52 @@ class HealthMonitorManager(BaseManager):
     def delete(self, context, health_monitor):
         """Delete a health monitor."""
 
-        self.loadbalancer = health_monitor.pool.loadbalancer
-        self.api_dict = self._get_hm_dict(health_monitor)
-        self._call_rpc(context, health_monitor, 'delete_health_monitor')
+        loadbalancer = health_monitor.pool.loadbalancer
+        api_dict = self._get_hm_dict(health_monitor)
+        self._call_rpc(context, loadbalancer, health_monitor, api_dict,
+                       'delete_health_monitor')
 
 
 class L7PolicyManager(BaseManager):
     """L7PolicyManager class handles Neutron LBaaS L7 Policy CRUD."""
 
+    def _get_policy_dict(self, policy, rules=False):
+        policy_dict = policy.to_dict(listener=False, rules=rules)
+        policy_dict['loadbalancer_id'] = policy.listener.loadbalancer.id
+        return policy_dict
+
     @log_helpers.log_method_call
     def create(self, context, policy):
-        """Create an L7 policy."""
+        """Create an L7 policy.
+
+        Agents that support it get the policy and its rules in one cast.
+        """
 
-        self.loadbalancer = policy.listener.loadbalancer
-        self.api_dict = policy.to_dict(listener=False, rules=False)
-        self._call_rpc(context, policy, 'create_l7policy')
+        loadbalancer = policy.listener.loadbalancer
+        if self.driver.agent_rpc.can_send_l7_rules():
+            api_dict = self._get_policy_dict(policy, rules=True)
+            self._call_rpc(context, loadbalancer, policy, api_dict,
+                           'create_l7policy_with_rules')
+        else:
+            api_dict = self._get_policy_dict(policy)
+            self._call_rpc(context, loadbalancer, policy, api_dict,
+                           'create_l7policy')
 
     @log_helpers.log_method_call
     def update(self, context, old_policy, policy):
         """Update a policy."""
 
         driver = self.driver
-        self.loadbalancer = policy.listener.loadbalancer
+        loadbalancer = policy.listener.loadbalancer
         try:
-            agent_host = self._setup_crud(context, policy)
+            agent_host = self._setup_crud(context, loadbalancer, policy)
             driver.agent_rpc.update_l7policy(
                 context,
-                old_policy.to_dict(listener=False),
-                policy.to_dict(listener=False),
+                self._get_policy_dict(old_policy, rules=True),
+                self._get_policy_dict(policy, rules=True),
                 agent_host
             )
+            self._track_digest(loadbalancer, None)
         except Exception as e:
             LOG.error("Exception: l7policy update: %s" % e.message)
             raise e
@@ -469,36 +1013,47 @@ class L7PolicyManager(BaseManager):
     def delete(self, context, policy):
         """Delete a policy."""
 
-        self.loadbalancer = policy.listener.loadbalancer
-        self.api_dict = policy.to_dict(listener=False, rules=False)
-        self._call_rpc(context, policy, 'delete_l7policy')
+        loadbalancer = policy.listener.loadbalancer
+        api_dict = self._get_policy_dict(policy)
+        self._call_rpc(context, loadbalancer, policy, api_dict,
+                       'delete_l7policy')
 
 
 class L7RuleManager(BaseManager):
-    """L7RuleManager class handles Neutron LBaaS L7 Rule CRUD."""
+    """L7RuleManager class handles Neutron LBaaS L7 Rule CRUD.
+
+    With array_l7rule_batch_window set, the rule changes of a policy are
+    sent to the agent together, see agent_rpc.L7RuleBatcher.
+    """
+
+    def _get_rule_dict(self, rule):
+        rule_dict = rule.to_dict(policy=False)
+        rule_dict['loadbalancer_id'] = rule.policy.listener.loadbalancer.id
+        return rule_dict
 
     @log_helpers.log_method_call
     def create(self, context, rule):
         """Create an L7 rule."""
 
-        self.loadbalancer = rule.policy.listener.loadbalancer
-        self.api_dict = rule.to_dict(policy=False)
-        self._call_rpc(context, rule, 'create_l7rule')
+        loadbalancer = rule.policy.listener.loadbalancer
+        api_dict = self._get_rule_dict(rule)
+        self._call_rpc(context, loadbalancer, rule, api_dict, 'create_l7rule')
 
     @log_helpers.log_method_call
     def update(self, context, old_rule, rule):
         """Update a rule."""
 
         driver = self.driver
-        self.loadbalancer = rule.policy.listener.loadbalancer
+        loadbalancer = rule.policy.listener.loadbalancer
         try:
-            agent_host = self._setup_crud(context, rule)
+            agent_host = self._setup_crud(context, loadbalancer, rule)
             driver.agent_rpc.update_l7rule(
                 context,
-                old_rule.to_dict(policy=False),
-                rule.to_dict(policy=False),
+                self._get_rule_dict(old_rule),
+                self._get_rule_dict(rule),
                 agent_host
             )
+            self._track_digest(loadbalancer, None)
         except Exception as e:
             LOG.error("Exception: l7rule update: %s" % e.message)
             raise e
@@ -507,6 +1062,6 @@ class L7RuleManager(BaseManager):
     def delete(self, context, rule):
         """Delete a rule."""
 
-        self.loadbalancer = rule.policy.listener.loadbalancer
-        self.api_dict = rule.to_dict(policy=False)
-        self._call_rpc(context, rule, 'delete_l7rule')
+        loadbalancer = rule.policy.listener.loadbalancer
+        api_dict = self._get_rule_dict(rule)
+        self._call_rpc(context, loadbalancer, rule, api_dict, 'delete_l7rule')
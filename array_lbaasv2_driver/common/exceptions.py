@@ -29,3 +29,12 @@ class ArrayNoAttachedLoadbalancerException(ArrayLBaaSv2DriverException):
 
     def __str__(self):
         return self.message
+
+
+class ArrayDispatchQueueFullException(ArrayLBaaSv2DriverException):
+    """Exception thrown when the agent dispatch queue has no room left."""
+
+    message = "Agent dispatch queue is full, retry later"
+
+    def __str__(self):
+        return self.message
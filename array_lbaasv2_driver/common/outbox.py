@@ -0,0 +1,184 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_service import loopingcall
+import sqlalchemy as sa
+from sqlalchemy.ext import declarative
+from sqlalchemy import func
+
+from neutron_lib import context as ncontext
+
+LOG = logging.getLogger(__name__)
+
+OUTBOX_OPTS = [
+    cfg.BoolOpt(
+        'array_rpc_outbox',
+        default=False,
+        help=('Record casts to the agents in the array_rpc_outbox table, '
+              'within the transaction of the caller when one is open, '
+              'and send them from a background dispatcher. Casts then '
+              'survive broker outages and neutron-server restarts')
+    ),
+    cfg.IntOpt(
+        'array_rpc_outbox_interval',
+        default=1,
+        help=('Interval in seconds between two runs of the outbox '
+              'dispatcher')
+    ),
+    cfg.IntOpt(
+        'array_rpc_outbox_batch_size',
+        default=200,
+        help=('Maximum number of casts sent per dispatcher run')
+    ),
+    cfg.IntOpt(
+        'array_rpc_outbox_max_backoff',
+        default=300,
+        help=('Upper bound in seconds of the exponential delay between '
+              'two attempts to send a cast')
+    )
+]
+
+cfg.CONF.register_opts(OUTBOX_OPTS, "arraynetworks")
+
+# kept apart from the neutron models, the table is not managed by the
+# neutron migrations and is created on startup
+BASE = declarative.declarative_base()
+
+
+class ArrayRpcOutbox(BASE):
+    __tablename__ = 'array_rpc_outbox'
+
+    id = sa.Column(sa.BigInteger().with_variant(sa.Integer(), 'sqlite'),
+                   primary_key=True, autoincrement=True)
+    loadbalancer_id = sa.Column(sa.String(36), nullable=True, index=True)
+    method = sa.Column(sa.String(255), nullable=False)
+    payload = sa.Column(sa.Text(), nullable=False)
+    attempts = sa.Column(sa.Integer(), nullable=False, default=0)
+    next_attempt = sa.Column(sa.DateTime(), nullable=False, index=True)
+
+
+class CastOutbox(object):
+    """Durable queue of casts drained in order per loadbalancer.
+
+    Rows are sent in id order. When a cast fails it is retried with an
+    exponential backoff and the later casts of its loadbalancer wait for
+    it. A row is leased before being sent by bumping its attempts, so
+    several neutron-server processes can drain the same table; a cast is
+    sent at least once.
+
+    :param send: callable(context, msg, **kwargs) performing the cast
+    """
+
+    def __init__(self, send):
+        self._send = send
+        self._dispatcher = None
+
+    def start(self):
+        context = ncontext.get_admin_context()
+        BASE.metadata.create_all(context.session.get_bind(),
+                                 checkfirst=True)
+        self._dispatcher = loopingcall.FixedIntervalLoopingCall(
+            self.dispatch)
+        self._dispatcher.start(
+            interval=cfg.CONF.arraynetworks.array_rpc_outbox_interval)
+
+    def add(self, context, loadbalancer_id, msg, kwargs):
+        """Record a cast, msg must only hold primitive types."""
+
+        row = ArrayRpcOutbox(
+            loadbalancer_id=loadbalancer_id,
+            method=msg['method'],
+            payload=jsonutils.dumps({'context': context.to_dict(),
+                                     'msg': msg,
+                                     'kwargs': kwargs}),
+            attempts=0,
+            next_attempt=datetime.datetime.utcnow())
+        with context.session.begin(subtransactions=True):
+            context.session.add(row)
+
+    def _backoff(self, attempts):
+        return datetime.timedelta(seconds=min(
+            2 ** attempts,
+            cfg.CONF.arraynetworks.array_rpc_outbox_max_backoff))
+
+    def _lease(self, session, row, now):
+        """Take row for one attempt, False if another process has it."""
+
+        with session.begin(subtransactions=True):
+            leased = (session.query(ArrayRpcOutbox).
+                      filter_by(id=row.id, attempts=row.attempts).
+                      update({'attempts': row.attempts + 1,
+                              'next_attempt':
+                                  now + self._backoff(row.attempts + 1)},
+                             synchronize_session=False))
+        return leased == 1
+
+    def dispatch(self):
+        try:
+            context = ncontext.get_admin_context()
+            session = context.session
+            now = datetime.datetime.utcnow()
+
+            # the first waiting cast of a loadbalancer holds back the later
+            # ones, so casts reach the agent in the order they were made
+            blocked = dict(
+                session.query(ArrayRpcOutbox.loadbalancer_id,
+                              func.min(ArrayRpcOutbox.id)).
+                filter(ArrayRpcOutbox.next_attempt > now).
+                group_by(ArrayRpcOutbox.loadbalancer_id))
+            rows = (session.query(ArrayRpcOutbox).
+                    filter(ArrayRpcOutbox.next_attempt <= now).
+                    order_by(ArrayRpcOutbox.id).
+                    limit(cfg.CONF.arraynetworks.array_rpc_outbox_batch_size).
+                    all())
+        except Exception as e:
+            LOG.error("Exception: outbox dispatch: %s" % e)
+            return
+
+        for row in rows:
+            lb_id = row.loadbalancer_id
+            if lb_id in blocked and blocked[lb_id] < row.id:
+                continue
+            try:
+                if not self._lease(session, row, now):
+                    blocked.setdefault(lb_id, row.id)
+                    continue
+                payload = jsonutils.loads(row.payload)
+                self._send(ncontext.Context.from_dict(payload['context']),
+                           payload['msg'], **payload['kwargs'])
+            except Exception as e:
+                LOG.warning("Outbox cast %s %s failed, attempt %d: %s" %
+                            (row.id, row.method, row.attempts + 1, e))
+                blocked.setdefault(lb_id, row.id)
+                continue
+            try:
+                with session.begin(subtransactions=True):
+                    (session.query(ArrayRpcOutbox).
+                     filter_by(id=row.id).
+                     delete(synchronize_session=False))
+            except Exception as e:
+                LOG.error("Exception: outbox delete %s: %s" % (row.id, e))
+                blocked.setdefault(lb_id, row.id)
+
+    def stats(self):
+        context = ncontext.get_admin_context()
+        pending, oldest = context.session.query(
+            func.count(ArrayRpcOutbox.id),
+            func.min(ArrayRpcOutbox.next_attempt)).one()
+        return {'pending': pending, 'oldest_attempt': oldest}
@@ -10,20 +10,73 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import collections
 import logging
 
+from oslo_config import cfg
+from sqlalchemy import orm
+
+from neutron.plugins.common import constants as plugin_constants
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
 from neutron_lib import constants as n_const
+from neutron_lib import context as ncontext
+from neutron_lbaas.agent_scheduler import LoadbalancerAgentBinding
+from neutron_lbaas.db.loadbalancer import models
+from neutron_lbaas.services.loadbalancer import constants as lb_const
 from neutron_lbaas.services.loadbalancer import data_models
 
+from array_lbaasv2_driver.common import agent_rpc
+from array_lbaasv2_driver.common import cache
 from array_lbaasv2_driver.common import db
+from array_lbaasv2_driver.common import utils
 
 LOG = logging.getLogger(__name__)
 
+PLUGIN_RPC_OPTS = [
+    cfg.IntOpt(
+        'array_neutron_cache_ttl',
+        default=60,
+        help=('Seconds subnets and networks read for the agents are '
+              'cached. Entries are also dropped when neutron updates or '
+              'deletes the resource, but only in the neutron-server '
+              'process making the change; changes made in other '
+              'processes are seen once the entry expires, so the TTL '
+              'bounds how stale an entry can be. 0 disables the cache')
+    ),
+    cfg.IntOpt(
+        'array_neutron_cache_size',
+        default=1024,
+        help=('Maximum number of subnets, and separately of networks, '
+              'kept in the cache')
+    ),
+    cfg.IntOpt(
+        'array_sync_page_size',
+        default=100,
+        help=('Maximum number of loadbalancers returned by one '
+              'get_loadbalancers_for_host call')
+    )
+]
+
+cfg.CONF.register_opts(PLUGIN_RPC_OPTS, "arraynetworks")
+
+
+def _event_resource_id(resource, kwargs):
+    payload = kwargs.get('payload')
+    if getattr(payload, 'resource_id', None):
+        return payload.resource_id
+    obj = kwargs.get(resource)
+    if isinstance(obj, dict):
+        return obj.get('id')
+    return kwargs.get(resource + '_id')
+
 
 class ArrayLoadBalancerCallbacks(object):
     """Callbacks made by the agent to update the data model."""
 
-    RPC_API_VERSION = '1.0'
+    # 1.1 - wait argument of get_vlan_id_by_port_cmcc
+    RPC_API_VERSION = '1.1'
 
     # class properties
     OBJ_TYPE_LB = "loadbalancer"
@@ -31,10 +84,24 @@ class ArrayLoadBalancerCallbacks(object):
     OBJ_TYPE_POOL = "pool"
     OBJ_TYPE_MEMBER = "member"
     OBJ_TYPE_HM = "hm"
+    OBJ_TYPE_L7POLICY = "l7policy"
+    OBJ_TYPE_L7RULE = "l7rule"
+
+    # outcomes accepted by bulk_completion
+    OUTCOME_SUCCESS = "success"
+    OUTCOME_DELETE = "delete"
+    OUTCOME_FAIL = "fail"
 
-    def __init__(self, driver):
+    # children are removed before their parents
+    DELETE_ORDER = (OBJ_TYPE_L7RULE, OBJ_TYPE_L7POLICY, OBJ_TYPE_MEMBER,
+                    OBJ_TYPE_HM, OBJ_TYPE_POOL, OBJ_TYPE_LISTENER,
+                    OBJ_TYPE_LB)
+
+    def __init__(self, driver, workers=None):
         LOG.debug('Apv status callbacks RPC subscriber initialized')
         self.driver = driver
+        self.workers = workers
+        self.vip_port_pool = None
 
         self._table = {
             "loadbalancer.success": self.driver.load_balancer.successful_completion,
@@ -57,20 +124,98 @@ class ArrayLoadBalancerCallbacks(object):
             "hm.delete": self.driver.health_monitor.successful_completion,
             "hm.fail": self.driver.health_monitor.failed_completion,
 
+            "l7policy.success": self.driver.l7policy.successful_completion,
+            "l7policy.delete": self.driver.l7policy.successful_completion,
+            "l7policy.fail": self.driver.l7policy.failed_completion,
+
+            "l7rule.success": self.driver.l7rule.successful_completion,
+            "l7rule.delete": self.driver.l7rule.successful_completion,
+            "l7rule.fail": self.driver.l7rule.failed_completion,
+
             "loadbalancer.model": data_models.LoadBalancer,
             "listener.model": data_models.Listener,
             "pool.model": data_models.Pool,
             "member.model": data_models.Member,
             "hm.model": data_models.HealthMonitor,
+            "l7policy.model": data_models.L7Policy,
+            "l7rule.model": data_models.L7Rule,
+
+            "loadbalancer.sa_model": models.LoadBalancer,
+            "listener.sa_model": models.Listener,
+            "pool.sa_model": models.PoolV2,
+            "member.sa_model": models.MemberV2,
+            "hm.sa_model": models.HealthMonitorV2,
+            "l7policy.sa_model": models.L7Policy,
+            "l7rule.sa_model": models.L7Rule,
+
+            "listener.db_delete": "delete_listener",
+            "pool.db_delete": "delete_pool",
+            "member.db_delete": "delete_pool_member",
+            "hm.db_delete": "delete_healthmonitor",
+            "l7policy.db_delete": "delete_l7policy",
+            "l7rule.db_delete": "delete_l7policy_rule",
         }
 
+        self._subnets = None
+        self._networks = None
+        ttl = cfg.CONF.arraynetworks.array_neutron_cache_ttl
+        if ttl > 0:
+            size = cfg.CONF.arraynetworks.array_neutron_cache_size
+            self._subnets = cache.LRUCache(size, ttl=ttl)
+            self._networks = cache.LRUCache(size, ttl=ttl)
+            for event in (events.AFTER_UPDATE, events.AFTER_DELETE):
+                registry.subscribe(self._subnet_changed,
+                                   resources.SUBNET, event)
+                registry.subscribe(self._network_changed,
+                                   resources.NETWORK, event)
+
+    def _subnet_changed(self, resource, event, trigger, **kwargs):
+        subnet_id = _event_resource_id(resources.SUBNET, kwargs)
+        if subnet_id:
+            self._subnets.pop(subnet_id)
+        else:
+            self._subnets.clear()
+
+    def _network_changed(self, resource, event, trigger, **kwargs):
+        network_id = _event_resource_id(resources.NETWORK, kwargs)
+        if network_id:
+            self._networks.pop(network_id)
+        else:
+            self._networks.clear()
+
+    @property
+    def _core_plugin(self):
+        return self.driver.plugin.db._core_plugin
+
+    def _cached_get(self, lru, getter, context, obj_id):
+        if lru is None:
+            return getter(context, obj_id)
+        obj = lru.get(obj_id)
+        if obj is None:
+            obj = getter(context, obj_id)
+            lru.set(obj_id, obj)
+        return obj
+
+    def get_cache_stats(self):
+        if self._subnets is None:
+            return {}
+        return {'subnets': self._subnets.stats(),
+                'networks': self._networks.stats()}
+
     def _successful_completion(self, context, obj_type, obj, delete=False,
             lb_create=False):
+        # only a loadbalancer create changes fields (the VIP) besides the
+        # status, everything else is updated by id
+        lb_id = self._fast_path_lb_id(obj_type, obj)
+        if lb_id and not delete and not lb_create:
+            self._status_by_id(context, obj_type, obj['id'], lb_id,
+                               self.OUTCOME_SUCCESS)
+            return
+
         success = self._table.get(obj_type+".success", None)
         model = self._table.get(obj_type+".model", None)
         if success:
-            if not isinstance(obj, model):
-                obj = model.from_dict(obj)
+            obj = self._to_model(model, obj)
             success(context, obj, delete, lb_create)
             if lb_create and isinstance(obj, data_models.LoadBalancer):
                 self.driver.plugin.db.update_loadbalancer(
@@ -79,12 +224,24 @@ class ArrayLoadBalancerCallbacks(object):
         else:
             LOG.error('Invalid obj_type: %s', obj_type)
 
+    @staticmethod
+    def _obj_id(obj):
+        return obj['id'] if isinstance(obj, dict) else obj.id
+
+    @staticmethod
+    def _to_model(model, obj):
+        if isinstance(obj, model):
+            return obj
+        # payloads may carry fields the driver adds, e.g. the
+        # loadbalancer_id of L7 objects, which the model does not take
+        return model.from_dict(dict((key, value) for key, value in obj.items()
+                                    if key in model.fields))
+
     def _deleting_completion(self, context, obj_type, obj):
         delete = self._table.get(obj_type+".delete", None)
         model = self._table.get(obj_type+".model", None)
         if delete:
-            if not isinstance(obj, model):
-                obj = model.from_dict(obj)
+            obj = self._to_model(model, obj)
             delete(context, obj, delete=True)
             if obj == obj.root_loadbalancer:
                 self.driver.plugin.db._core_plugin.delete_port(context, obj.vip_port_id)
@@ -92,63 +249,218 @@ class ArrayLoadBalancerCallbacks(object):
             LOG.error('Invalid obj_type: %s', obj_type)
 
     def _failed_completion(self, context, obj_type, obj):
+        lb_id = self._fast_path_lb_id(obj_type, obj)
+        if lb_id:
+            self._status_by_id(context, obj_type, obj['id'], lb_id,
+                               self.OUTCOME_FAIL)
+            return
+
         failed = self._table.get(obj_type+".fail", None)
         model = self._table.get(obj_type+".model", None)
         if failed:
-            if not isinstance(obj, model):
-                obj = model.from_dict(obj)
+            obj = self._to_model(model, obj)
             failed(context, obj)
         else:
             LOG.error('Invalid obj_type: %s', obj_type)
 
+    def bulk_completion(self, context, entries, loadbalancer_id=None):
+        """Apply many completion results, one transaction per loadbalancer.
+
+        :param entries: list of (obj_type, obj, outcome) where outcome is
+            one of "success", "delete" or "fail"
+        :param loadbalancer_id: loadbalancer all the entries belong to,
+            e.g. for the outcome of a delete_loadbalancer_cascade. When
+            not given it is looked up from each obj
+
+        Object statuses are written directly and the provisioning status
+        of every affected loadbalancer is recomputed once for the batch,
+        instead of once per object. The entries of a loadbalancer are
+        applied by the callback worker owning it, after the callbacks
+        already queued for it, on an admin context of its own since the
+        workers run concurrently.
+        """
+
+        groups = collections.OrderedDict()
+        for obj_type, obj, outcome in entries:
+            lb_id = loadbalancer_id or utils.get_root_loadbalancer_id(obj)
+            if obj_type + ".sa_model" not in self._table or lb_id is None:
+                LOG.error('Invalid bulk entry: %s %s', obj_type, obj)
+                continue
+            groups.setdefault(lb_id, []).append((obj_type, obj, outcome))
+
+        for lb_id, group in groups.items():
+            self._submit(lb_id, self._bulk_completion,
+                         ncontext.get_admin_context(), lb_id, group)
+
+    def _bulk_completion(self, context, loadbalancer_id, entries):
+        plugin_db = self.driver.plugin.db
+        lb_status = None
+        deletes = []
+        lb_delete = None
+        with context.session.begin(subtransactions=True):
+            for obj_type, obj, outcome in entries:
+                if outcome == self.OUTCOME_DELETE:
+                    if obj_type == self.OBJ_TYPE_LB:
+                        lb_delete = obj
+                    else:
+                        deletes.append((obj_type, obj))
+                elif outcome in (self.OUTCOME_SUCCESS, self.OUTCOME_FAIL):
+                    status = self._write_status(context, obj_type,
+                                                self._obj_id(obj), outcome)
+                    if lb_status is None or status == plugin_constants.ERROR:
+                        lb_status = status
+                else:
+                    LOG.error('Invalid bulk outcome: %s', outcome)
+
+            deletes.sort(key=lambda entry: self.DELETE_ORDER.index(entry[0]))
+            for obj_type, obj in deletes:
+                db_delete = self._table[obj_type + ".db_delete"]
+                getattr(plugin_db, db_delete)(context, self._obj_id(obj))
+                if lb_status is None:
+                    lb_status = plugin_constants.ACTIVE
+
+            if lb_status is not None and lb_delete is None:
+                plugin_db.update_status(context, models.LoadBalancer,
+                                        loadbalancer_id,
+                                        provisioning_status=lb_status)
+
+        # deleting a loadbalancer also deletes its VIP port through the
+        # core plugin, which refuses to run inside an open transaction
+        if lb_delete is not None:
+            self._deleting_completion(context, self.OBJ_TYPE_LB, lb_delete)
+
+    def local_completion(self, obj_type, obj, outcome):
+        """Complete an operation the agent will never report on.
+
+        Used for casts dropped by the driver: the delete of an object the
+        agent never got to create succeeds, a cast that could not be
+        sent fails. The payloads of those casts leave out the parent
+        objects, e.g. a rule has no policy, so the outcome is applied by
+        id as bulk_completion does, through the loadbalancer_id they
+        carry. The callback worker gets an admin context of its own, the
+        one of the API request that made the cast may still be in use.
+        """
+        lb_id = utils.get_root_loadbalancer_id(obj)
+        if obj_type + ".sa_model" not in self._table or lb_id is None:
+            LOG.error('Invalid local completion: %s %s', obj_type, obj)
+            return
+        self._submit(lb_id, self._bulk_completion,
+                     ncontext.get_admin_context(), lb_id,
+                     [(obj_type, obj, outcome)])
+
+    def status_completion(self, context, obj_type, obj_id, loadbalancer_id,
+                          outcome):
+        """Report a success/fail outcome by id, without the object itself."""
+        self._submit(loadbalancer_id, self._status_by_id, context,
+                     obj_type, obj_id, loadbalancer_id, outcome)
+
+    def _status_by_id(self, context, obj_type, obj_id, loadbalancer_id,
+                      outcome):
+        with context.session.begin(subtransactions=True):
+            status = self._write_status(context, obj_type, obj_id, outcome)
+            if obj_type != self.OBJ_TYPE_LB:
+                self.driver.plugin.db.update_status(
+                    context, models.LoadBalancer, loadbalancer_id,
+                    provisioning_status=status)
+
+    def _write_status(self, context, obj_type, obj_id, outcome):
+        """Write an object's status, returns the status for its loadbalancer.
+        """
+        sa_model = self._table[obj_type + ".sa_model"]
+        if outcome == self.OUTCOME_SUCCESS:
+            self.driver.plugin.db.update_status(
+                context, sa_model, obj_id,
+                provisioning_status=plugin_constants.ACTIVE,
+                operating_status=lb_const.ONLINE)
+            return plugin_constants.ACTIVE
+
+        self.driver.plugin.db.update_status(
+            context, sa_model, obj_id,
+            provisioning_status=plugin_constants.ERROR,
+            operating_status=lb_const.OFFLINE)
+        if obj_type == self.OBJ_TYPE_LB:
+            return plugin_constants.ERROR
+        return plugin_constants.ACTIVE
+
+    def _fast_path_lb_id(self, obj_type, obj):
+        """Root loadbalancer id when obj can take the id based fast path."""
+        if not isinstance(obj, dict) or not obj.get('id'):
+            return None
+        if obj_type + ".sa_model" not in self._table:
+            return None
+        return utils.get_root_loadbalancer_id(obj)
+
+    def _dispatch(self, obj, func, *args):
+        """Run a completion inline or on the worker owning its loadbalancer."""
+        self._submit(utils.get_root_loadbalancer_id(obj), func, *args)
+
+    def _submit(self, key, func, *args):
+        if self.workers is None:
+            func(*args)
+        else:
+            self.workers.submit(key, func, *args)
+
     def lb_successful_completion(self, context, obj, delete=False, lb_create=False):
-        self._successful_completion(context, self.OBJ_TYPE_LB, obj, delete, lb_create)
+        self._dispatch(obj, self._successful_completion, context,
+                       self.OBJ_TYPE_LB, obj, delete, lb_create)
 
     def lb_deleting_completion(self, context, obj):
-        self._deleting_completion(context, self.OBJ_TYPE_LB, obj)
+        self._dispatch(obj, self._deleting_completion, context,
+                       self.OBJ_TYPE_LB, obj)
 
     def lb_failed_completion(self, context, obj):
-        self._failed_completion(context, self.OBJ_TYPE_LB, obj)
+        self._dispatch(obj, self._failed_completion, context,
+                       self.OBJ_TYPE_LB, obj)
 
     def listener_successful_completion(self, context, obj):
-        self._successful_completion(context, self.OBJ_TYPE_LISTENER, obj) 
+        self._dispatch(obj, self._successful_completion, context,
+                       self.OBJ_TYPE_LISTENER, obj)
 
     def listener_deleting_completion(self, context, obj):
-        self._deleting_completion(context, self.OBJ_TYPE_LISTENER, obj)
+        self._dispatch(obj, self._deleting_completion, context,
+                       self.OBJ_TYPE_LISTENER, obj)
 
     def listener_failed_completion(self, context, obj):
-        self._failed_completion(context, self.OBJ_TYPE_LISTENER, obj)
+        self._dispatch(obj, self._failed_completion, context,
+                       self.OBJ_TYPE_LISTENER, obj)
 
     def pool_successful_completion(self, context, obj):
-        self._successful_completion(context, self.OBJ_TYPE_POOL, obj) 
+        self._dispatch(obj, self._successful_completion, context,
+                       self.OBJ_TYPE_POOL, obj)
 
     def pool_deleting_completion(self, context, obj):
-        self._deleting_completion(context, self.OBJ_TYPE_POOL, obj)
+        self._dispatch(obj, self._deleting_completion, context,
+                       self.OBJ_TYPE_POOL, obj)
 
     def pool_failed_completion(self, context, obj):
-        self._failed_completion(context, self.OBJ_TYPE_POOL, obj)
+        self._dispatch(obj, self._failed_completion, context,
+                       self.OBJ_TYPE_POOL, obj)
 
     def member_successful_completion(self, context, obj):
-        self._successful_completion(context, self.OBJ_TYPE_MEMBER, obj) 
+        self._dispatch(obj, self._successful_completion, context,
+                       self.OBJ_TYPE_MEMBER, obj)
 
     def member_deleting_completion(self, context, obj):
-        self._deleting_completion(context, self.OBJ_TYPE_MEMBER, obj)
+        self._dispatch(obj, self._deleting_completion, context,
+                       self.OBJ_TYPE_MEMBER, obj)
 
     def member_failed_completion(self, context, obj):
-        self._failed_completion(context, self.OBJ_TYPE_MEMBER, obj)
+        self._dispatch(obj, self._failed_completion, context,
+                       self.OBJ_TYPE_MEMBER, obj)
 
     def hm_successful_completion(self, context, obj):
-        self._successful_completion(context, self.OBJ_TYPE_HM, obj) 
+        self._dispatch(obj, self._successful_completion, context,
+                       self.OBJ_TYPE_HM, obj)
 
     def hm_deleting_completion(self, context, obj):
-        self._deleting_completion(context, self.OBJ_TYPE_HM, obj)
+        self._dispatch(obj, self._deleting_completion, context,
+                       self.OBJ_TYPE_HM, obj)
 
     def hm_failed_completion(self, context, obj):
-        self._failed_completion(context, self.OBJ_TYPE_HM, obj)
+        self._dispatch(obj, self._failed_completion, context,
+                       self.OBJ_TYPE_HM, obj)
 
-    def create_port_on_subnet(self, context, subnet_id, name,
-            fixed_address_count=1):
-        subnet = self.driver.plugin.db._core_plugin.get_subnet(context, subnet_id)
+    def _make_port_data(self, subnet, name, fixed_address_count):
         fixed_ip = {'subnet_id': subnet['id']}
         if fixed_address_count > 1:
             fixed_ips = []
@@ -156,7 +468,7 @@ class ArrayLoadBalancerCallbacks(object):
                 fixed_ips.append(fixed_ip)
         else:
             fixed_ips = [fixed_ip]
-        port_data = {
+        return {
             'tenant_id': subnet['tenant_id'],
             'name': name,
             'network_id': subnet['network_id'],
@@ -166,13 +478,34 @@ class ArrayLoadBalancerCallbacks(object):
             'device_owner': '',
             'fixed_ips': fixed_ips
         }
-        return self.driver.plugin.db._core_plugin.create_port(context, {'port': port_data})
+
+    def create_port_on_subnet(self, context, subnet_id, name,
+            fixed_address_count=1):
+        if self.vip_port_pool is not None and fixed_address_count == 1:
+            port = self.vip_port_pool.take(context, subnet_id, name)
+            if port:
+                return port
+        subnet = self.get_subnet(context, subnet_id)
+        port_data = self._make_port_data(subnet, name, fixed_address_count)
+        return self._core_plugin.create_port(context, {'port': port_data})
+
+    def create_ports_on_subnet(self, context, subnet_id, names,
+            fixed_address_count=1):
+        """Create one port per name on subnet_id in a single bulk call."""
+        subnet = self.get_subnet(context, subnet_id)
+        ports = [{'port': self._make_port_data(subnet, name,
+                                               fixed_address_count)}
+                 for name in names]
+        return self._core_plugin.create_port_bulk(context, {'ports': ports})
 
     def get_subnet(self, context, subnet_id):
-        return self.driver.plugin.db._core_plugin.get_subnet(context, subnet_id)
+        return self._cached_get(self._subnets, self._core_plugin.get_subnet,
+                                context, subnet_id)
 
     def get_network(self, context, network_id):
-        return self.driver.plugin.db._core_plugin.get_network(context, network_id)
+        return self._cached_get(self._networks,
+                                self._core_plugin.get_network,
+                                context, network_id)
 
     def get_port(self, context, port_id):
         return self.driver.plugin.db._core_plugin.get_port(context, port_id)
@@ -181,10 +514,87 @@ class ArrayLoadBalancerCallbacks(object):
         lb = self.driver.plugin.db.get_loadbalancer(context, loadbalancer_id)
         return lb.to_dict(stats=False)
 
-    def get_vlan_id_by_port_cmcc(self, context, port_id):
-        vlan_tag = db.get_vlan_id_by_port_cmcc(context, port_id)
+    def get_loadbalancers_for_host(self, context, host, marker=None,
+                                   limit=None, fields=None):
+        """Return one page of the loadbalancers bound to the agent on host.
+
+        Pages are ordered by loadbalancer id, pass the returned next_marker
+        back as marker to get the following page. fields optionally limits
+        the top level fields of each loadbalancer.
+
+        :returns: {'loadbalancers': [...], 'next_marker': id or None}
+        """
+
+        page_size = cfg.CONF.arraynetworks.array_sync_page_size
+        limit = min(limit or page_size, page_size)
+        agents = self.driver.plugin.db.get_lbaas_agents(
+            context, filters={'host': [host]})
+        if not agents:
+            return {'loadbalancers': [], 'next_marker': None}
+
+        query = (context.session.query(
+            LoadbalancerAgentBinding.loadbalancer_id).
+            filter(LoadbalancerAgentBinding.agent_id.in_(
+                [agent['id'] for agent in agents])))
+        if marker:
+            query = query.filter(
+                LoadbalancerAgentBinding.loadbalancer_id > marker)
+        lb_ids = [row[0] for row in query.order_by(
+            LoadbalancerAgentBinding.loadbalancer_id).limit(limit + 1)]
+        next_marker = lb_ids[limit - 1] if len(lb_ids) > limit else None
+        lb_ids = lb_ids[:limit]
+
+        loadbalancers = []
+        if lb_ids:
+            # load the page with a fixed number of queries whatever its
+            # size: every relation from_sqlalchemy_model() walks is loaded
+            # eagerly, lazy loads would cost a query per object
+            lb_dbs = (context.session.query(models.LoadBalancer).
+                      filter(models.LoadBalancer.id.in_(lb_ids)).
+                      options(orm.joinedload('vip_port'),
+                              orm.joinedload('stats'),
+                              orm.joinedload('provider'),
+                              orm.subqueryload('listeners').
+                              subqueryload('sni_containers'),
+                              orm.subqueryload('listeners').
+                              subqueryload('l7_policies').
+                              subqueryload('rules'),
+                              orm.subqueryload('pools').
+                              subqueryload('members'),
+                              orm.subqueryload('pools').
+                              joinedload('healthmonitor'),
+                              orm.subqueryload('pools').
+                              joinedload('session_persistence'),
+                              orm.subqueryload('pools').
+                              subqueryload('listeners'),
+                              orm.subqueryload('pools').
+                              subqueryload('l7_policies')).
+                      order_by(models.LoadBalancer.id))
+            for lb_db in lb_dbs:
+                lb = data_models.LoadBalancer.from_sqlalchemy_model(lb_db)
+                loadbalancers.append(
+                    agent_rpc.DataModelSerializer.to_dict(
+                        lb, set(fields) if fields else None))
+        return {'loadbalancers': loadbalancers, 'next_marker': next_marker}
+
+    def get_vlan_id_by_port_cmcc(self, context, port_id, wait=True):
+        """Return the VLAN ID of port_id as {'vlan_tag': ...}.
+
+        With wait the call holds its RPC worker until the port is bound,
+        see db.get_vlan_id_by_port_cmcc. Agents passing wait=False get
+        'pending': True with a vlan_tag of '-1' for a port not bound yet
+        and are expected to ask again.
+        """
+        vlan_tag = db.get_vlan_id_by_port_cmcc(context, port_id, wait=wait)
         if not vlan_tag:
             vlan_tag = '-1'
         ret = {'vlan_tag': str(vlan_tag)}
+        if vlan_tag == '-1' and port_id and not wait:
+            ret['pending'] = True
         return ret
 
+    def get_vlan_ids_by_ports(self, context, port_ids):
+        vlan_tags = db.get_vlan_ids_by_ports(context, port_ids)
+        return dict((port_id, {'vlan_tag': str(vlan_tag or '-1')})
+                    for port_id, vlan_tag in vlan_tags.items())
+
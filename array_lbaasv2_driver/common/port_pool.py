@@ -0,0 +1,211 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import collections
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_service import loopingcall
+
+from neutron.db import models_v2
+from neutron_lib import context as ncontext
+
+LOG = logging.getLogger(__name__)
+
+PORT_POOL_OPTS = [
+    cfg.BoolOpt(
+        'array_vip_port_pool',
+        default=False,
+        help=('Keep a pool of pre-created unbound ports on frequently '
+              'used subnets and serve single address port requests of '
+              'the agents from it')
+    ),
+    cfg.IntOpt(
+        'array_vip_port_pool_min_requests',
+        default=3,
+        help=('Number of port requests on a subnet before a pool is '
+              'maintained for it')
+    ),
+    cfg.IntOpt(
+        'array_vip_port_pool_low',
+        default=2,
+        help=('Refill the pool of a subnet when it holds fewer ports')
+    ),
+    cfg.IntOpt(
+        'array_vip_port_pool_high',
+        default=8,
+        help=('Number of ports a refill brings the pool of a subnet to')
+    ),
+    cfg.IntOpt(
+        'array_vip_port_pool_idle_timeout',
+        default=3600,
+        help=('Seconds without port requests after which the pooled '
+              'ports of a subnet are deleted')
+    )
+]
+
+cfg.CONF.register_opts(PORT_POOL_OPTS, "arraynetworks")
+
+POOL_PORT_NAME = 'array-vip-pool'
+# name of pooled ports claimed for deletion
+RECLAIMED_PORT_NAME = 'array-vip-pool-reclaimed'
+
+
+class VipPortPool(object):
+    """Warm pool of unbound ports per subnet.
+
+    Every neutron-server process adopts the pooled ports it finds at
+    start, so a pooled port may be known to several processes. A port is
+    only used once it has been claimed with a conditional rename that
+    succeeds for a single process.
+
+    :param create_ports: callable(context, subnet_id, names) creating one
+        port per name on the subnet, returns the created ports
+    :param get_core_plugin: callable returning the neutron core plugin
+    """
+
+    def __init__(self, create_ports, get_core_plugin):
+        self._create_ports = create_ports
+        self._get_core_plugin = get_core_plugin
+        self._lock = threading.Lock()
+        self._ports = collections.defaultdict(collections.deque)
+        self._requests = collections.defaultdict(int)
+        self._last_used = {}
+        self._refilling = set()
+        self._reclaimer = None
+
+    def start(self):
+        """Adopt pooled ports left by a previous run and start reclaiming."""
+
+        try:
+            context = ncontext.get_admin_context()
+            ports = self._get_core_plugin().get_ports(
+                context, filters={'name': [POOL_PORT_NAME]})
+            with self._lock:
+                for port in ports:
+                    if port['fixed_ips'] and not port['device_id']:
+                        subnet_id = port['fixed_ips'][0]['subnet_id']
+                        self._ports[subnet_id].append(port['id'])
+                        self._last_used.setdefault(subnet_id, time.time())
+        except Exception as e:
+            LOG.error("Exception: adopt pooled ports: %s" % e)
+        self.start_reclaimer()
+
+    def start_reclaimer(self):
+        """Reclaim the idle ports of this process' pool.
+
+        Called again by each neutron-server worker after the fork, the
+        looping call started by the parent does not run in it.
+        """
+        interval = max(
+            cfg.CONF.arraynetworks.array_vip_port_pool_idle_timeout // 2, 1)
+        self._reclaimer = loopingcall.FixedIntervalLoopingCall(self.reclaim)
+        self._reclaimer.start(interval=interval, initial_delay=interval)
+
+    def take(self, context, subnet_id, name):
+        """Return a pooled port of subnet_id renamed to name, or None."""
+
+        conf = cfg.CONF.arraynetworks
+        with self._lock:
+            self._requests[subnet_id] += 1
+            self._last_used[subnet_id] = time.time()
+            ports = self._ports[subnet_id]
+            port_id = ports.popleft() if ports else None
+            refill = (self._requests[subnet_id] >= conf.
+                      array_vip_port_pool_min_requests and
+                      len(ports) < conf.array_vip_port_pool_low and
+                      subnet_id not in self._refilling)
+            if refill:
+                self._refilling.add(subnet_id)
+
+        if refill:
+            thread = threading.Thread(target=self._refill, args=(subnet_id,))
+            thread.daemon = True
+            thread.start()
+
+        if port_id is None:
+            return None
+        try:
+            if not self._claim(context, port_id, name):
+                LOG.debug("Pooled port %s taken by another process" %
+                          port_id)
+                return None
+            return self._get_core_plugin().get_port(context, port_id)
+        except Exception as e:
+            LOG.warning("Pooled port %s unusable: %s" % (port_id, e))
+            return None
+
+    @staticmethod
+    def _claim(context, port_id, name):
+        """Rename a pooled port to name unless it was already claimed."""
+        with context.session.begin(subtransactions=True):
+            claimed = (context.session.query(models_v2.Port).
+                       filter_by(id=port_id, name=POOL_PORT_NAME,
+                                 device_id='').
+                       update({'name': name}, synchronize_session=False))
+        return claimed == 1
+
+    def _refill(self, subnet_id):
+        try:
+            with self._lock:
+                missing = (cfg.CONF.arraynetworks.array_vip_port_pool_high -
+                           len(self._ports[subnet_id]))
+            if missing <= 0:
+                return
+            context = ncontext.get_admin_context()
+            ports = self._create_ports(context, subnet_id,
+                                       [POOL_PORT_NAME] * missing)
+            with self._lock:
+                self._ports[subnet_id].extend(port['id'] for port in ports)
+        except Exception as e:
+            LOG.error("Exception: refill port pool of %s: %s" %
+                      (subnet_id, e))
+        finally:
+            with self._lock:
+                self._refilling.discard(subnet_id)
+
+    def reclaim(self):
+        """Delete the pooled ports of subnets idle past the timeout."""
+
+        deadline = (time.time() -
+                    cfg.CONF.arraynetworks.array_vip_port_pool_idle_timeout)
+        with self._lock:
+            idle = [subnet_id for subnet_id, used in self._last_used.items()
+                    if used < deadline and subnet_id not in self._refilling]
+            reclaimed = []
+            for subnet_id in idle:
+                reclaimed.extend(self._ports.pop(subnet_id, ()))
+                self._requests.pop(subnet_id, None)
+                del self._last_used[subnet_id]
+
+        if not reclaimed:
+            return
+        context = ncontext.get_admin_context()
+        core_plugin = self._get_core_plugin()
+        for port_id in reclaimed:
+            try:
+                if not self._claim(context, port_id, RECLAIMED_PORT_NAME):
+                    continue
+                core_plugin.delete_port(context, port_id)
+            except Exception as e:
+                LOG.warning("Unable to delete pooled port %s: %s" %
+                            (port_id, e))
+        LOG.info("Reclaimed %d pooled ports" % len(reclaimed))
+
+    def stats(self):
+        with self._lock:
+            return dict((subnet_id, len(ports))
+                        for subnet_id, ports in self._ports.items())
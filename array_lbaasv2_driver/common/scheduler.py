@@ -0,0 +1,140 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import random
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from sqlalchemy import func
+
+from neutron_lbaas.agent_scheduler import LoadbalancerAgentBinding
+from neutron_lbaas.db.loadbalancer import models
+
+LOG = logging.getLogger(__name__)
+
+SCHEDULER_OPTS = [
+    cfg.IntOpt(
+        'array_scheduler_index_ttl',
+        default=60,
+        help=('Seconds between rebuilds of the per-agent load index from '
+              'the database. Placements made in between are accounted '
+              'in memory')
+    ),
+    cfg.FloatOpt(
+        'array_scheduler_member_weight',
+        default=0.01,
+        help=('Load contributed by one member relative to one '
+              'loadbalancer when ranking agents')
+    )
+]
+
+cfg.CONF.register_opts(SCHEDULER_OPTS, "arraynetworks")
+
+
+class ArrayLoadBalancerScheduler(object):
+    """Place a loadbalancer on the least loaded Array agent.
+
+    The load of an agent is its number of loadbalancers plus its weighted
+    number of members, divided by the 'capacity' the agent reports in its
+    configurations (1 when it reports none). Counts come from an index
+    built with two aggregate queries and kept up to date in memory
+    between rebuilds, so a placement does not scan the binding tables.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._index_expires = 0
+        self._lock = threading.Lock()
+
+    def schedule(self, plugin, context, loadbalancer, device_driver):
+        with context.session.begin(subtransactions=True):
+            lbaas_agent = plugin.db.get_agent_hosting_loadbalancer(
+                context, loadbalancer.id)
+            if lbaas_agent:
+                return lbaas_agent['agent']
+
+            active_agents = plugin.db.get_lbaas_agents(context, active=True)
+            if not active_agents:
+                LOG.warning('No active lbaas agents for load balancer %s',
+                            loadbalancer.id)
+                return None
+
+            candidates = plugin.db.get_lbaas_agent_candidates(device_driver,
+                                                              active_agents)
+            if not candidates:
+                LOG.warning('No lbaas agent supporting device driver %s',
+                            device_driver)
+                return None
+
+            chosen_agent = self._select(plugin, context, candidates)
+            binding = LoadbalancerAgentBinding()
+            binding.agent = chosen_agent
+            binding.loadbalancer_id = loadbalancer.id
+            context.session.add(binding)
+
+            with self._lock:
+                counts = self._index.setdefault(chosen_agent['id'], [0, 0])
+                counts[0] += 1
+            LOG.debug('Loadbalancer %(loadbalancer_id)s is scheduled to '
+                      'lbaas agent %(agent_id)s',
+                      {'loadbalancer_id': loadbalancer.id,
+                       'agent_id': chosen_agent['id']})
+            return chosen_agent
+
+    def _select(self, plugin, context, candidates):
+        self._refresh_index(context)
+        member_weight = cfg.CONF.arraynetworks.array_scheduler_member_weight
+
+        scored = []
+        with self._lock:
+            for agent in candidates:
+                lbs, members = self._index.get(agent['id'], (0, 0))
+                conf = plugin.db.get_configuration_dict(agent)
+                capacity = float(conf.get('capacity') or 1)
+                scored.append(((lbs + members * member_weight) / capacity,
+                               agent))
+        best = min(score for score, agent in scored)
+        return random.choice([agent for score, agent in scored
+                              if score == best])
+
+    def _refresh_index(self, context):
+        if self._index_expires > time.time():
+            return
+
+        index = {}
+        lb_counts = (context.session.query(
+            LoadbalancerAgentBinding.agent_id,
+            func.count(LoadbalancerAgentBinding.loadbalancer_id)).
+            group_by(LoadbalancerAgentBinding.agent_id))
+        for agent_id, count in lb_counts:
+            index[agent_id] = [count, 0]
+
+        member_counts = (context.session.query(
+            LoadbalancerAgentBinding.agent_id,
+            func.count(models.MemberV2.id)).
+            join(models.PoolV2, models.PoolV2.loadbalancer_id ==
+                 LoadbalancerAgentBinding.loadbalancer_id).
+            join(models.MemberV2, models.MemberV2.pool_id ==
+                 models.PoolV2.id).
+            group_by(LoadbalancerAgentBinding.agent_id))
+        for agent_id, count in member_counts:
+            index.setdefault(agent_id, [0, 0])[1] = count
+
+        with self._lock:
+            self._index = index
+            self._index_expires = (
+                time.time() +
+                cfg.CONF.arraynetworks.array_scheduler_index_ttl)
@@ -0,0 +1,73 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import bisect
+import hashlib
+import threading
+
+
+def get_root_loadbalancer_id(obj):
+    """Return the id of the loadbalancer obj belongs to, if it is known.
+
+    obj may be a neutron-lbaas data model or its to_dict() form, in which
+    case the id is looked up through the parent references it carries.
+    """
+
+    if obj is None:
+        return None
+    if not isinstance(obj, dict):
+        root = getattr(obj, 'root_loadbalancer', None)
+        return getattr(root, 'id', None)
+    if obj.get('loadbalancer_id'):
+        return obj['loadbalancer_id']
+    if 'vip_address' in obj:
+        return obj.get('id')
+    for parent in ('loadbalancer', 'listener', 'pool', 'policy'):
+        if isinstance(obj.get(parent), dict):
+            return get_root_loadbalancer_id(obj[parent])
+    return None
+
+
+class HashRing(object):
+    """Consistent hash ring mapping keys to a changing set of nodes."""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._lock = threading.Lock()
+        self._nodes = frozenset()
+        self._points = []
+        self._owners = []
+        self.set_nodes(nodes)
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+    def set_nodes(self, nodes):
+        nodes = frozenset(nodes)
+        if nodes == self._nodes:
+            return
+        ring = sorted((self._hash('%s-%d' % (node, replica)), node)
+                      for node in nodes for replica in range(self.replicas))
+        with self._lock:
+            self._nodes = nodes
+            self._points = [point for point, node in ring]
+            self._owners = [node for point, node in ring]
+
+    def get_node(self, key):
+        with self._lock:
+            if not self._points:
+                return None
+            index = bisect.bisect(self._points, self._hash(key))
+            return self._owners[index % len(self._owners)]
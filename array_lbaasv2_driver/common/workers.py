@@ -0,0 +1,206 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import collections
+import os
+import threading
+import time
+import zlib
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class _LaneQueue(object):
+    """Bounded queue with priority lanes that keeps per-key order.
+
+    All the queued items of a key sit in one lane: an item queued with a
+    higher priority than the lane of its key moves the earlier items of
+    the key along to its lane, an item queued with a lower priority joins
+    them in theirs. The highest priority lane is served first, but a lane
+    passed over starvation_limit times while holding items is served next.
+    """
+
+    def __init__(self, maxsize=0, lanes=1, starvation_limit=8):
+        self.maxsize = maxsize
+        self.starvation_limit = starvation_limit
+        self._lanes = [collections.deque() for i in range(lanes)]
+        self._skipped = [0] * lanes
+        # key -> [lane, number of queued items]
+        self._keys = {}
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def put(self, key, priority, item, block=True):
+        """Queue item, return False when full and block is False."""
+
+        priority = min(priority, len(self._lanes) - 1)
+        with self._cond:
+            while self.maxsize and self._size >= self.maxsize:
+                if not block:
+                    return False
+                self._cond.wait()
+
+            entry = self._keys.get(key)
+            if entry is None:
+                entry = self._keys[key] = [priority, 0]
+            elif entry[0] > priority:
+                self._promote(key, entry[0], priority)
+                entry[0] = priority
+            self._lanes[entry[0]].append((key, item))
+            entry[1] += 1
+            self._size += 1
+            self._cond.notify_all()
+        return True
+
+    def _promote(self, key, source, target):
+        kept = collections.deque()
+        moved = self._lanes[target]
+        for queued in self._lanes[source]:
+            (moved if queued[0] == key else kept).append(queued)
+        self._lanes[source] = kept
+
+    def _next_lane(self):
+        busy = [lane for lane, items in enumerate(self._lanes) if items]
+        starved = [lane for lane in busy
+                   if self._skipped[lane] >= self.starvation_limit]
+        chosen = starved[0] if starved else busy[0]
+        for lane in busy:
+            self._skipped[lane] = 0 if lane == chosen else (
+                self._skipped[lane] + 1)
+        return chosen
+
+    def get(self):
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+            key, item = self._lanes[self._next_lane()].popleft()
+            entry = self._keys[key]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._keys[key]
+            self._size -= 1
+            self._cond.notify_all()
+            return item
+
+    def qsize(self):
+        return self._size
+
+    def depths(self):
+        with self._cond:
+            return [len(items) for items in self._lanes]
+
+
+class PartitionedWorkerPool(object):
+    """Run submitted work on a fixed set of worker threads.
+
+    Work is partitioned by key: everything submitted with the same key is
+    handled by the same worker in submission order, while work for other
+    keys proceeds in parallel on the other workers.
+
+    With maxsize each worker queues at most that many items: submit()
+    then waits for room while offer() gives up. With several lanes,
+    work submitted with a higher priority is handled ahead of the work
+    queued for other keys, see _LaneQueue.
+
+    Threads do not survive a fork: a neutron-server worker forked after
+    the pool was created calls start() to get threads of its own.
+    """
+
+    # number of recent enqueue to completion latencies kept for stats()
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self, name, workers, maxsize=0, lanes=1,
+                 starvation_limit=8):
+        self.name = name
+        self.processed = 0
+        self.rejected = 0
+        self._latencies = collections.deque(maxlen=self.LATENCY_SAMPLES)
+        self._workers = workers
+        self._queue_args = (maxsize, lanes, starvation_limit)
+        self._queues = []
+        self._pid = None
+        self.start()
+
+    def start(self):
+        """Start the worker threads, once per process."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        # the queues of the parent may have been copied with a lock held
+        self._queues = [_LaneQueue(*self._queue_args)
+                        for i in range(self._workers)]
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._run,
+                                      args=(work_queue,),
+                                      name='%s-%d' % (self.name, index))
+            thread.daemon = True
+            thread.start()
+
+    def _partition(self, key):
+        data = (key or '').encode('utf-8')
+        return (zlib.crc32(data) & 0xffffffff) % len(self._queues)
+
+    def submit(self, key, func, *args, **kwargs):
+        self.submit_with_priority(PRIORITY_NORMAL, key, func, *args, **kwargs)
+
+    def offer(self, key, func, *args, **kwargs):
+        """Like submit() but return False instead of waiting for room."""
+        return self.offer_with_priority(PRIORITY_NORMAL, key, func,
+                                        *args, **kwargs)
+
+    def submit_with_priority(self, priority, key, func, *args, **kwargs):
+        self._queues[self._partition(key)].put(
+            key, priority, (time.time(), func, args, kwargs))
+
+    def offer_with_priority(self, priority, key, func, *args, **kwargs):
+        if not self._queues[self._partition(key)].put(
+                key, priority, (time.time(), func, args, kwargs),
+                block=False):
+            self.rejected += 1
+            return False
+        return True
+
+    def stats(self):
+        depths = [work_queue.qsize() for work_queue in self._queues]
+        lanes = [sum(depth) for depth in
+                 zip(*[work_queue.depths() for work_queue in self._queues])]
+        latencies = sorted(self._latencies)
+        stats = {'workers': len(self._queues),
+                 'depth': sum(depths),
+                 'depths': depths,
+                 'lane_depths': lanes,
+                 'processed': self.processed,
+                 'rejected': self.rejected}
+        if latencies:
+            stats['latency_avg'] = sum(latencies) / len(latencies)
+            stats['latency_p99'] = latencies[int(len(latencies) * 0.99)]
+            stats['latency_max'] = latencies[-1]
+        return stats
+
+    def _run(self, work_queue):
+        while True:
+            enqueued, func, args, kwargs = work_queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                LOG.exception("Exception: %s worker: %s" % (self.name, e))
+            finally:
+                self.processed += 1
+                self._latencies.append(time.time() - enqueued)
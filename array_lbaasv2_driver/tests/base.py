@@ -0,0 +1,39 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from oslo_config import cfg
+from oslo_db import options as db_options
+
+from neutron_lib import context as ncontext
+
+
+class SqliteTestCase(unittest.TestCase):
+    """Run against the neutron session of an in-memory SQLite database.
+
+    TABLES lists the SQLAlchemy tables created for each test.
+    """
+
+    TABLES = []
+
+    def setUp(self):
+        super(SqliteTestCase, self).setUp()
+        db_options.set_defaults(cfg.CONF, connection='sqlite://')
+        self.context = ncontext.get_admin_context()
+        engine = self.context.session.get_bind()
+        for table in self.TABLES:
+            table.create(engine, checkfirst=True)
+            self.addCleanup(table.drop, engine)
+        self.addCleanup(cfg.CONF.reset)
@@ -0,0 +1,84 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import collections
+import threading
+import time
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+Cast = collections.namedtuple('Cast', ['method', 'payload', 'host'])
+
+
+class FakeAgentRPC(object):
+    """Stand-in for LBaaSv2AgentRPC recording the casts made through it.
+
+    Every RPC method of the agent is accepted, its last two arguments
+    being the payload and the agent host. A cast takes latency seconds,
+    as a round trip to the broker would; peak is the highest number of
+    casts seen in flight at once.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.casts = []
+        self.peak = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def can_send_l7_rules(self):
+        return False
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def cast(context, *args):
+            with self._lock:
+                self._in_flight += 1
+                self.peak = max(self.peak, self._in_flight)
+            time.sleep(self.latency)
+            with self._lock:
+                self._in_flight -= 1
+                self.casts.append(Cast(method, args[-2], args[-1]))
+        return cast
+
+
+class FakeDriver(object):
+    """The parts of ArrayDriverV2 the managers use.
+
+    Every loadbalancer is hosted by its own agent, see host_of().
+    """
+
+    def __init__(self, agent_rpc, schedule_latency=0):
+        self.agent_rpc = agent_rpc
+        self.digests = None
+        self.plugin = mock.Mock()
+        self._schedule_latency = schedule_latency
+
+    @staticmethod
+    def host_of(loadbalancer_id):
+        return 'host-%s' % loadbalancer_id
+
+    def schedule_agent(self, context, loadbalancer):
+        # other operations get to run meanwhile, as they do during the
+        # database queries of the real scheduler
+        time.sleep(self._schedule_latency)
+        return {'host': self.host_of(loadbalancer.id)}
+
+    def get_agent_host(self, context, loadbalancer_id):
+        return self.host_of(loadbalancer_id)
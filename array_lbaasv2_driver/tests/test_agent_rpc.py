@@ -0,0 +1,178 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from oslo_config import cfg
+import oslo_messaging as messaging
+from oslo_messaging import conffixture
+
+from neutron.common import rpc as n_rpc
+from neutron.db.migration.models import head  # noqa
+from neutron.plugins.common import constants as plugin_constants
+from neutron_lib.db import model_base
+from neutron_lbaas.db.loadbalancer import loadbalancer_dbv2
+from neutron_lbaas.db.loadbalancer import models
+from neutron_lbaas.services.loadbalancer import data_models
+
+from array_lbaasv2_driver.common import agent_rpc
+from array_lbaasv2_driver.common import plugin_rpc
+from array_lbaasv2_driver.tests import base
+
+HOST = 'agent'
+
+
+class TestLocalCompletion(base.SqliteTestCase):
+    """Casts dropped by the driver complete against the neutron-lbaas db."""
+
+    # the neutron models reference each other, create all their tables
+    TABLES = model_base.BASEV2.metadata.sorted_tables
+
+    def setUp(self):
+        super(TestLocalCompletion, self).setUp()
+        messaging_conf = conffixture.ConfFixture(cfg.CONF)
+        messaging_conf.transport_url = 'fake:/'
+        messaging_conf.setUp()
+        self.addCleanup(messaging_conf.cleanUp)
+        n_rpc.init(cfg.CONF)
+        self.addCleanup(n_rpc.cleanup)
+        # long windows, nothing is flushed by the timers during a test
+        for opt, value in (('array_agent_rpc_version_cap', '1.4'),
+                           ('array_l7rule_batch_window', 60000),
+                           ('array_rpc_coalesce_window', 60000)):
+            cfg.CONF.set_override(opt, value, group='arraynetworks')
+
+        self.driver = mock.Mock()
+        self.driver.plugin.db = loadbalancer_dbv2.LoadBalancerPluginDbv2()
+        self.driver.callbacks = plugin_rpc.ArrayLoadBalancerCallbacks(
+            self.driver)
+        self.agent_rpc = agent_rpc.LBaaSv2AgentRPC(self.driver)
+
+        session = self.context.session
+        with session.begin(subtransactions=True):
+            session.add(models.LoadBalancer(
+                id='lb', vip_subnet_id='subnet', admin_state_up=True,
+                provisioning_status=plugin_constants.PENDING_UPDATE,
+                operating_status='ONLINE'))
+            session.add(models.Listener(
+                id='listener', loadbalancer_id='lb', protocol='HTTP',
+                protocol_port=80, admin_state_up=True,
+                provisioning_status=plugin_constants.ACTIVE,
+                operating_status='ONLINE'))
+
+    def _add_policy(self, provisioning_status):
+        session = self.context.session
+        with session.begin(subtransactions=True):
+            session.add(models.L7Policy(
+                id='policy', listener_id='listener', action='REJECT',
+                position=1, admin_state_up=True,
+                provisioning_status=provisioning_status))
+
+    def _policy(self):
+        loadbalancer = data_models.LoadBalancer(id='lb')
+        listener = data_models.Listener(id='listener', loadbalancer_id='lb',
+                                        loadbalancer=loadbalancer)
+        return data_models.L7Policy(id='policy', listener_id='listener',
+                                    listener=listener, action='REJECT',
+                                    position=1, admin_state_up=True)
+
+    def _send(self):
+        """Patch the sending of the casts left after coalescing."""
+        return mock.patch.object(self.agent_rpc._coalescer, '_send')
+
+    def _get(self, model, obj_id):
+        self.context.session.expire_all()
+        return self.context.session.query(model).filter_by(
+            id=obj_id).first()
+
+    def test_rule_created_and_deleted_within_the_batch_window(self):
+        self._add_policy(plugin_constants.ACTIVE)
+        session = self.context.session
+        with session.begin(subtransactions=True):
+            session.add(models.L7Rule(
+                id='rule', l7policy_id='policy', type='PATH',
+                compare_type='STARTS_WITH', value='/api', invert=False,
+                admin_state_up=True,
+                provisioning_status=plugin_constants.PENDING_DELETE))
+        rule = data_models.L7Rule(
+            id='rule', l7policy_id='policy', policy=self._policy(),
+            type='PATH', compare_type='STARTS_WITH', value='/api',
+            invert=False, admin_state_up=True)
+        # the payload built by L7RuleManager
+        rule_dict = rule.to_dict(policy=False)
+        rule_dict['loadbalancer_id'] = 'lb'
+
+        with self._send() as send:
+            self.agent_rpc.create_l7rule(self.context, rule_dict, HOST)
+            self.agent_rpc.delete_l7rule(self.context, rule_dict, HOST)
+            self.agent_rpc._rule_batcher.flush()
+            self.agent_rpc._coalescer.flush()
+
+        self.assertFalse(send.called)
+        self.assertIsNone(self._get(models.L7Rule, 'rule'))
+        self.assertEqual(plugin_constants.ACTIVE,
+                         self._get(models.LoadBalancer,
+                                   'lb').provisioning_status)
+
+    def test_policy_created_and_deleted_within_the_coalesce_window(self):
+        self._add_policy(plugin_constants.PENDING_DELETE)
+        # the payload built by L7PolicyManager
+        policy_dict = self._policy().to_dict(listener=False, rules=False)
+        policy_dict['loadbalancer_id'] = 'lb'
+
+        with self._send() as send:
+            self.agent_rpc.create_l7policy(self.context, policy_dict, HOST)
+            self.agent_rpc.delete_l7policy(self.context, policy_dict, HOST)
+            self.agent_rpc._coalescer.flush()
+
+        self.assertFalse(send.called)
+        self.assertIsNone(self._get(models.L7Policy, 'policy'))
+        self.assertEqual(plugin_constants.ACTIVE,
+                         self._get(models.LoadBalancer,
+                                   'lb').provisioning_status)
+
+    def test_cast_failing_on_a_dispatch_worker(self):
+        cfg.CONF.set_override('array_rpc_coalesce_window', 0,
+                              group='arraynetworks')
+        cfg.CONF.set_override('array_rpc_dispatch_workers', 1,
+                              group='arraynetworks')
+        rpc = agent_rpc.LBaaSv2AgentRPC(self.driver)
+        self._add_policy(plugin_constants.PENDING_CREATE)
+        policy_dict = self._policy().to_dict(listener=False, rules=False)
+        policy_dict['loadbalancer_id'] = 'lb'
+        completed = threading.Event()
+        complete_failed = rpc._complete_failed
+
+        def complete(context, msg):
+            complete_failed(context, msg)
+            completed.set()
+
+        with mock.patch.object(rpc, '_send_cast',
+                               side_effect=messaging.MessagingTimeout()), \
+                mock.patch.object(rpc, '_complete_failed',
+                                  side_effect=complete):
+            rpc.create_l7policy(self.context, policy_dict, HOST)
+            self.assertTrue(completed.wait(10))
+
+        self.assertEqual(plugin_constants.ERROR,
+                         self._get(models.L7Policy,
+                                   'policy').provisioning_status)
+        self.assertEqual(plugin_constants.ACTIVE,
+                         self._get(models.LoadBalancer,
+                                   'lb').provisioning_status)
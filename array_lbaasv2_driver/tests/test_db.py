@@ -0,0 +1,130 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from oslo_config import cfg
+
+from neutron.db.migration.models import head  # noqa
+from neutron.db import models_v2
+from neutron.plugins.ml2 import models
+from neutron_lib.db import model_base
+
+from array_lbaasv2_driver.common import db
+from array_lbaasv2_driver.tests import base
+
+
+class TestVlanLookup(base.SqliteTestCase):
+
+    # the neutron models reference each other, create all their tables
+    TABLES = model_base.BASEV2.metadata.sorted_tables
+
+    def setUp(self):
+        super(TestVlanLookup, self).setUp()
+        cfg.CONF.set_override('array_vlan_cache_size', 16,
+                              group='arraynetworks')
+        db._vlan_cache = None
+        self.addCleanup(setattr, db, '_vlan_cache', None)
+        session = self.context.session
+        with session.begin(subtransactions=True):
+            session.add(models_v2.Network(id='net', name='net',
+                                          admin_state_up=True,
+                                          status='ACTIVE'))
+
+    def _bind(self, port_id, segmentation_id, network_type='vlan',
+              level=db.CMCC_DEFAULT_LEVEL):
+        session = self.context.session
+        segment_id = 'segment-%s-%s' % (port_id, level)
+        with session.begin(subtransactions=True):
+            session.add(models_v2.Port(
+                id=port_id, network_id='net', mac_address=port_id,
+                admin_state_up=True, status='ACTIVE', device_id='',
+                device_owner=''))
+            session.add(models.NetworkSegment(
+                id=segment_id, network_id='net', network_type=network_type,
+                physical_network=segment_id, segmentation_id=segmentation_id))
+            session.add(models.PortBindingLevel(
+                port_id=port_id, host='host', level=level, driver='array',
+                segment_id=segment_id))
+
+    def _unbind_all(self):
+        session = self.context.session
+        with session.begin(subtransactions=True):
+            for level in session.query(models.PortBindingLevel):
+                session.delete(level)
+
+    def test_segmentation_ids_of_vlan_bindings_at_default_level(self):
+        self._bind('p1', 100)
+        self._bind('p2', 200, level=0)
+        self._bind('p3', 300, network_type='vxlan')
+
+        self.assertEqual(
+            {'p1': '100'},
+            db._get_segmentation_ids(self.context, ['p1', 'p2', 'p3', 'p4']))
+
+    def test_segmentation_ids_of_no_ports(self):
+        with mock.patch.object(self.context.session, 'query') as query:
+            self.assertEqual({}, db._get_segmentation_ids(self.context, []))
+        self.assertFalse(query.called)
+
+    def test_vlan_ids_by_ports_in_chunks(self):
+        for i in range(5):
+            self._bind('p%d' % i, 100 + i)
+
+        with mock.patch.object(db, '_get_segmentation_ids',
+                               wraps=db._get_segmentation_ids) as lookup:
+            result = db.get_vlan_ids_by_ports(
+                self.context, ['p%d' % i for i in range(6)], chunk_size=2)
+
+        self.assertEqual(3, lookup.call_count)
+        expected = dict(('p%d' % i, str(100 + i)) for i in range(5))
+        expected['p5'] = None
+        self.assertEqual(expected, result)
+
+    def test_vlan_ids_by_ports_from_cache(self):
+        self._bind('p1', 100)
+        db.get_vlan_ids_by_ports(self.context, ['p1', 'p2'])
+        self._unbind_all()
+
+        with mock.patch.object(db, '_get_segmentation_ids',
+                               wraps=db._get_segmentation_ids) as lookup:
+            result = db.get_vlan_ids_by_ports(self.context, ['p1', 'p2'])
+
+        self.assertEqual({'p1': '100', 'p2': None}, result)
+        lookup.assert_called_once_with(self.context, ['p2'])
+
+    def test_vlan_ids_by_ports_after_binding_change(self):
+        self._bind('p1', 100)
+        db.get_vlan_ids_by_ports(self.context, ['p1'])
+        self._unbind_all()
+        db._port_deleted('port', 'after_delete', None,
+                         port={'id': 'p1'})
+
+        self.assertEqual({'p1': None},
+                         db.get_vlan_ids_by_ports(self.context, ['p1']))
+
+    def test_vlan_id_without_waiting(self):
+        cfg.CONF.set_override('array_request_vlan_timeout', 60,
+                              group='arraynetworks')
+        with mock.patch.object(db, '_add_port_waiter') as waiter:
+            self.assertIsNone(
+                db.get_vlan_id_by_port_cmcc(self.context, 'p1', wait=False))
+            self._bind('p1', 100)
+            self.assertEqual(
+                '100',
+                db.get_vlan_id_by_port_cmcc(self.context, 'p1', wait=False))
+        self.assertFalse(waiter.called)
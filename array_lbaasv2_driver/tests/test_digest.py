@@ -0,0 +1,64 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from array_lbaasv2_driver.common import digest
+from array_lbaasv2_driver.tests import base
+
+MEMBER = {'id': 'm1', 'address': '10.0.0.1', 'protocol_port': 80,
+          'provisioning_status': 'ACTIVE'}
+
+
+class TestDigestStore(base.SqliteTestCase):
+
+    TABLES = [digest.ArrayObjectDigest.__table__]
+
+    def setUp(self):
+        super(TestDigestStore, self).setUp()
+        # the API worker tracking changes and the process reconciling
+        self.api = digest.DigestStore()
+        self.reconciler = digest.DigestStore()
+
+    def test_untracked_loadbalancer(self):
+        self.api.update('lb1', 'member:m1', MEMBER)
+        self.assertIsNone(self.reconciler.get('lb1'))
+
+    def test_changes_seen_by_another_process(self):
+        self.reconciler.set('lb1', {'loadbalancer:lb1': 'a',
+                                    'member:m0': 'b'})
+        self.api.update('lb1', 'member:m1', MEMBER)
+        self.api.remove('lb1', 'member:m0')
+
+        self.assertEqual(
+            {'loadbalancer:lb1': 'a',
+             'member:m1': digest.content_hash(digest._own_fields(MEMBER))},
+            self.reconciler.get('lb1'))
+
+    def test_update_of_a_tracked_object(self):
+        self.reconciler.set('lb1', {'loadbalancer:lb1': 'a',
+                                    'member:m1': 'b'})
+        self.api.update('lb1', 'member:m1',
+                        dict(MEMBER, provisioning_status='PENDING_UPDATE'))
+        self.api.update('lb1', 'member:m1', MEMBER)
+
+        self.assertEqual(digest.content_hash(digest._own_fields(MEMBER)),
+                         self.reconciler.get('lb1')['member:m1'])
+
+    def test_invalidate(self):
+        self.reconciler.set('lb1', {'loadbalancer:lb1': 'a'})
+        self.reconciler.set('lb2', {'loadbalancer:lb2': 'a'})
+        self.api.invalidate('lb1')
+
+        self.assertIsNone(self.reconciler.get('lb1'))
+        self.assertEqual({'loadbalancer:lb2': 'a'},
+                         self.reconciler.get('lb2'))
@@ -0,0 +1,169 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import collections
+import datetime
+from multiprocessing import pool as mp_pool
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from neutron_lbaas.services.loadbalancer import data_models
+
+from array_lbaasv2_driver.common import cache
+from array_lbaasv2_driver.common import driver_v2
+from array_lbaasv2_driver.tests import fakes
+
+CONTEXT = mock.sentinel.context
+
+
+class TestManagerConcurrency(unittest.TestCase):
+    """Run interleaved CRUD operations through shared managers."""
+
+    LOADBALANCERS = 20
+    MEMBERS = 5
+
+    def setUp(self):
+        super(TestManagerConcurrency, self).setUp()
+        self.agent_rpc = fakes.FakeAgentRPC(latency=0.001)
+        driver = fakes.FakeDriver(self.agent_rpc, schedule_latency=0.001)
+        self.managers = {
+            'listener': driver_v2.ListenerManager(driver),
+            'pool': driver_v2.PoolManager(driver),
+            'member': driver_v2.MemberManager(driver),
+        }
+        self.owner = {}
+        self.entities = []
+        for i in range(self.LOADBALANCERS):
+            lb = data_models.LoadBalancer(id='lb-%d' % i)
+            listener = data_models.Listener(
+                id='listener-%d' % i, loadbalancer_id=lb.id,
+                loadbalancer=lb, protocol='HTTP', protocol_port=80)
+            pool = data_models.Pool(
+                id='pool-%d' % i, loadbalancer_id=lb.id, loadbalancer=lb,
+                protocol='HTTP', lb_algorithm='ROUND_ROBIN')
+            self._add('listener', listener, lb)
+            self._add('pool', pool, lb)
+            for j in range(self.MEMBERS):
+                self._add('member', data_models.Member(
+                    id='member-%d-%d' % (i, j), pool_id=pool.id, pool=pool,
+                    address='10.0.%d.%d' % (i, j), protocol_port=80), lb)
+
+    def _add(self, kind, entity, loadbalancer):
+        self.owner[entity.id] = loadbalancer.id
+        self.entities.append((kind, entity))
+
+    def _operations(self, count):
+        """Cycle through create, update and delete of every object."""
+
+        operations = []
+        for n in range(count):
+            kind, entity = self.entities[n % len(self.entities)]
+            op = ('create', 'update', 'delete')[
+                n // len(self.entities) % 3]
+            operations.append((kind, op, entity))
+        return operations
+
+    def _call(self, operation):
+        kind, op, entity = operation
+        manager = self.managers[kind]
+        if op == 'update':
+            manager.update(CONTEXT, entity, entity)
+        else:
+            getattr(manager, op)(CONTEXT, entity)
+
+    def _run(self, operations, workers):
+        """Run operations on workers threads."""
+
+        threads = mp_pool.ThreadPool(workers)
+        try:
+            threads.map(self._call, operations, chunksize=1)
+        finally:
+            threads.close()
+            threads.join()
+
+    def test_interleaved_crud_reaches_the_owning_agent(self):
+        operations = self._operations(3000)
+        self._run(operations, workers=32)
+
+        casts = self.agent_rpc.casts
+        self.assertEqual(len(operations), len(casts))
+        for cast in casts:
+            self.assertEqual(
+                fakes.FakeDriver.host_of(self.owner[cast.payload['id']]),
+                cast.host)
+        self.assertEqual(
+            collections.Counter('%s_%s' % (op, kind)
+                                for kind, op, entity in operations),
+            collections.Counter(cast.method for cast in casts))
+        self.assertEqual(
+            collections.Counter(entity.id
+                                for kind, op, entity in operations),
+            collections.Counter(cast.payload['id'] for cast in casts))
+
+    def test_casts_overlap_across_workers(self):
+        self._run(self._operations(600), workers=8)
+
+        # no lock held by the managers serializes the casts
+        self.assertGreater(self.agent_rpc.peak, 1)
+
+
+class TestAgentCheck(unittest.TestCase):
+    """The agents are looked up by the process casting."""
+
+    def setUp(self):
+        super(TestAgentCheck, self).setUp()
+        cfg.CONF.set_override('array_agent_check_interval', 30,
+                              group='arraynetworks')
+        self.addCleanup(cfg.CONF.reset)
+        # a forked neutron-server worker: no looping call ever ran in it
+        self.driver = driver_v2.ArrayDriverV2.__new__(driver_v2.ArrayDriverV2)
+        self.driver.plugin = mock.Mock()
+        self.driver.agent_rpc = mock.Mock()
+        self.driver.binding_cache = cache.LRUCache(16)
+        self.driver._agents_checked = 0
+        self.driver._agent_check_lock = threading.Lock()
+        now = timeutils.utcnow()
+        self.driver.plugin.db.get_lbaas_agents.return_value = [
+            {'host': 'up', 'admin_state_up': True,
+             'heartbeat_timestamp': now},
+            {'host': 'down', 'admin_state_up': True,
+             'heartbeat_timestamp': now - datetime.timedelta(hours=1)}]
+        self.driver.binding_cache.set('lb', {'id': 'agent', 'host': 'down'})
+        self.driver.binding_cache.set('lb2', {'id': 'agent', 'host': 'up'})
+
+    def test_first_lookup_checks_the_agents(self):
+        agent = self.driver.get_hosting_agent(CONTEXT, 'lb2')
+        self.driver.get_hosting_agent(CONTEXT, 'lb2')
+
+        self.assertEqual('up', agent['host'])
+        self.assertEqual(
+            1, self.driver.plugin.db.get_lbaas_agents.call_count)
+        self.driver.agent_rpc.set_agent_hosts.assert_called_once_with(['up'])
+        self.assertIsNone(self.driver.binding_cache.get('lb'))
+
+    def test_agents_checked_again_after_the_interval(self):
+        self.driver.check_agents()
+        self.driver._agents_checked -= 31
+        self.driver.check_agents()
+
+        self.assertEqual(
+            2, self.driver.plugin.db.get_lbaas_agents.call_count)
@@ -0,0 +1,184 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import datetime
+import threading
+
+from oslo_config import cfg
+import oslo_messaging as messaging
+
+from array_lbaasv2_driver.common import outbox
+from array_lbaasv2_driver.tests import base
+
+TOPIC = 'array_lbaasv2_agent'
+
+
+class FakeAgent(object):
+    """RPC endpoint recording the casts it receives."""
+
+    def __init__(self, expected):
+        self.calls = []
+        self.done = threading.Event()
+        self._expected = expected
+
+    def _record(self, method, obj):
+        self.calls.append((method, obj['id']))
+        if len(self.calls) >= self._expected:
+            self.done.set()
+
+    def create_member(self, context, obj):
+        self._record('create_member', obj)
+
+    def update_member(self, context, obj):
+        self._record('update_member', obj)
+
+    def delete_member(self, context, obj):
+        self._record('delete_member', obj)
+
+
+class FlakySender(object):
+    """send() failing for the casts of the given object ids."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def __call__(self, context, msg, **kwargs):
+        obj_id = msg['args']['obj']['id']
+        if obj_id in self.failing:
+            raise messaging.MessagingTimeout('no reply for %s' % obj_id)
+        self.sent.append((msg['method'], obj_id))
+
+
+def _msg(method, obj_id):
+    return {'method': method, 'namespace': None,
+            'args': {'obj': {'id': obj_id}}}
+
+
+class TestCastOutbox(base.SqliteTestCase):
+
+    TABLES = [outbox.ArrayRpcOutbox.__table__]
+
+    def _add(self, box, lb_id, method, obj_id):
+        box.add(self.context, lb_id, _msg(method, obj_id), {})
+
+    def _rows(self):
+        return dict((row.loadbalancer_id, row) for row in
+                    self.context.session.query(outbox.ArrayRpcOutbox))
+
+    def _make_due(self):
+        session = self.context.session
+        with session.begin(subtransactions=True):
+            session.query(outbox.ArrayRpcOutbox).update(
+                {'next_attempt': datetime.datetime.utcnow() -
+                    datetime.timedelta(seconds=1)},
+                synchronize_session=False)
+
+    def test_dispatch_through_fake_transport(self):
+        transport = messaging.get_rpc_transport(cfg.CONF, url='fake:/')
+        self.addCleanup(transport.cleanup)
+        agent = FakeAgent(expected=3)
+        server = messaging.get_rpc_server(
+            transport, messaging.Target(topic=TOPIC, server='agent'),
+            [agent], executor='threading')
+        server.start()
+        self.addCleanup(server.wait)
+        self.addCleanup(server.stop)
+        client = messaging.RPCClient(transport,
+                                     messaging.Target(topic=TOPIC))
+
+        def send(context, msg, **kwargs):
+            client.prepare(**kwargs).cast(context.to_dict(), msg['method'],
+                                          **msg['args'])
+
+        box = outbox.CastOutbox(send)
+        self._add(box, 'lb1', 'create_member', 'm1')
+        self._add(box, 'lb1', 'update_member', 'm1')
+        self._add(box, 'lb1', 'delete_member', 'm1')
+        box.dispatch()
+
+        self.assertTrue(agent.done.wait(10))
+        self.assertEqual([('create_member', 'm1'), ('update_member', 'm1'),
+                          ('delete_member', 'm1')], agent.calls)
+        self.assertEqual(0, box.stats()['pending'])
+
+    def test_failed_cast_blocks_its_loadbalancer_only(self):
+        send = FlakySender(failing=['m1'])
+        box = outbox.CastOutbox(send)
+        self._add(box, 'lb1', 'create_member', 'm1')
+        self._add(box, 'lb1', 'create_member', 'm2')
+        self._add(box, 'lb2', 'create_member', 'm3')
+        box.dispatch()
+
+        self.assertEqual([('create_member', 'm3')], send.sent)
+        self.assertEqual(2, box.stats()['pending'])
+
+        # m1 is backing off, m2 waits behind it even though it is due
+        box.dispatch()
+        self.assertEqual([('create_member', 'm3')], send.sent)
+
+        send.failing.clear()
+        self._make_due()
+        box.dispatch()
+        self.assertEqual([('create_member', 'm3'), ('create_member', 'm1'),
+                          ('create_member', 'm2')], send.sent)
+        self.assertEqual(0, box.stats()['pending'])
+
+    def test_failed_cast_backs_off(self):
+        box = outbox.CastOutbox(FlakySender(failing=['m1']))
+        self._add(box, 'lb1', 'create_member', 'm1')
+        before = datetime.datetime.utcnow()
+        box.dispatch()
+
+        row = self._rows()['lb1']
+        self.assertEqual(1, row.attempts)
+        self.assertGreaterEqual(row.next_attempt,
+                                before + datetime.timedelta(seconds=2))
+
+    def test_backoff_is_capped(self):
+        cfg.CONF.set_override('array_rpc_outbox_max_backoff', 60,
+                              group='arraynetworks')
+        box = outbox.CastOutbox(FlakySender())
+        self.assertEqual(datetime.timedelta(seconds=8), box._backoff(3))
+        self.assertEqual(datetime.timedelta(seconds=60), box._backoff(10))
+
+    def test_lease_is_taken_once(self):
+        box = outbox.CastOutbox(FlakySender())
+        self._add(box, 'lb1', 'create_member', 'm1')
+        row = self._rows()['lb1']
+        now = datetime.datetime.utcnow()
+        session = self.context.session
+
+        self.assertTrue(box._lease(session, row, now))
+        # a second process holding the same snapshot of the row loses
+        self.assertFalse(box._lease(session, row, now))
+
+    def test_leased_row_is_skipped(self):
+        send = FlakySender()
+        box = outbox.CastOutbox(send)
+        self._add(box, 'lb1', 'create_member', 'm1')
+        self._add(box, 'lb1', 'create_member', 'm2')
+        first = self.context.session.query(outbox.ArrayRpcOutbox).order_by(
+            outbox.ArrayRpcOutbox.id).first()
+        # another process leases m1 while this one reads its batch
+        real_lease = box._lease
+
+        def lease(session, row, now):
+            if row.id == first.id:
+                real_lease(session, row, now)
+            return real_lease(session, row, now)
+
+        box._lease = lease
+        box.dispatch()
+        self.assertEqual([], send.sent)
@@ -53,6 +53,11 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
     def delete(self, context, lb):
         self.driver.array.loadbalancer.delete(context, lb)
 
+    def delete_cascade(self, context, lb):
+        # not called by the neutron-lbaas v2 plugin, which refuses to
+        # delete a loadbalancer with children, for out-of-tree callers only
+        self.driver.array.loadbalancer.delete_cascade(context, lb)
+
     def refresh(self, context, lb):
         self.driver.array.loadbalancer.refresh(context, lb)
 
@@ -95,6 +100,15 @@ class MemberManager(driver_base.BaseMemberManager):
     def delete(self, context, member):
         self.driver.array.member.delete(context, member)
 
+    def create_members(self, context, members):
+        self.driver.array.member.create_members(context, members)
+
+    def update_members(self, context, old_members, members):
+        self.driver.array.member.update_members(context, old_members, members)
+
+    def delete_members(self, context, members):
+        self.driver.array.member.delete_members(context, members)
+
 
 class HealthMonitorManager(driver_base.BaseHealthMonitorManager):
 
@@ -0,0 +1,69 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Time the casts of LBaaSv2AgentRPC over the oslo.messaging fake driver.
+
+Casts are routed to --hosts agent hosts in turn, once with the prepared
+client cache disabled (a prepare() per cast) and once with it enabled:
+
+    python tools/bench_rpc_cast.py --casts 20000 --hosts 8
+"""
+
+import argparse
+import timeit
+
+from oslo_config import cfg
+from oslo_messaging import conffixture
+
+from neutron.common import rpc as n_rpc
+from neutron_lib import context as ncontext
+
+from array_lbaasv2_driver.common import agent_rpc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--casts', type=int, default=20000)
+    parser.add_argument('--hosts', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    messaging_conf = conffixture.ConfFixture(cfg.CONF)
+    messaging_conf.transport_url = 'fake:/'
+    n_rpc.init(cfg.CONF)
+    cfg.CONF.set_override('array_rpc_host_routing', True,
+                          group='arraynetworks')
+
+    context = ncontext.get_admin_context()
+    hosts = ['host-%d' % i for i in range(args.hosts)]
+    member = {'id': 'member', 'pool_id': 'pool', 'address': '10.0.0.1',
+              'protocol_port': 80, 'weight': 1}
+
+    for cache_size in (0, args.hosts):
+        cfg.CONF.set_override('array_rpc_client_cache_size', cache_size,
+                              group='arraynetworks')
+        rpc = agent_rpc.LBaaSv2AgentRPC()
+
+        def run():
+            for i in range(args.casts):
+                rpc.update_member(context, member, member,
+                                  hosts[i % args.hosts])
+
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        print('client cache size %-4d %8.1f us/cast' %
+              (cache_size, best * 1e6 / args.casts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Time the serialization of a large loadbalancer tree.
+
+Builds a loadbalancer whose pools hold --members members in total, with
+every pool also used as the default pool of a listener, the way the
+plugin does: from unsaved database rows through from_sqlalchemy_model(),
+which makes a new data model instance of a row for every path reaching
+it. Compares the time and the memory allocated by
+BaseDataModel.to_dict() and DataModelSerializer.serialize_message():
+
+    python tools/bench_serializer.py --members 400
+"""
+
+import argparse
+import timeit
+import tracemalloc
+
+from neutron_lbaas.db.loadbalancer import models
+from neutron_lbaas.services.loadbalancer import data_models
+
+from array_lbaasv2_driver.common import agent_rpc
+
+
+def build_loadbalancer(pools, members):
+    lb = models.LoadBalancer(id='lb', name='bench', vip_address='10.0.0.10',
+                             provisioning_status='ACTIVE',
+                             operating_status='ONLINE', admin_state_up=True)
+    for i in range(pools):
+        pool = models.PoolV2(id='pool-%d' % i, protocol='HTTP',
+                             lb_algorithm='ROUND_ROBIN', loadbalancer=lb)
+        pool.healthmonitor = models.HealthMonitorV2(
+            id='hm-%d' % i, type='HTTP', delay=5, timeout=3, max_retries=3)
+        pool.session_persistence = models.SessionPersistenceV2(
+            pool_id=pool.id, type='HTTP_COOKIE')
+        pool.members = [
+            models.MemberV2(id='member-%d-%d' % (i, j),
+                            address='10.1.%d.%d' % (j // 250, j % 250),
+                            protocol_port=80, weight=1)
+            for j in range(members // pools)]
+        models.Listener(id='listener-%d' % i, protocol='HTTP',
+                        protocol_port=8000 + i, default_pool=pool,
+                        loadbalancer=lb)
+    return data_models.LoadBalancer.from_sqlalchemy_model(lb)
+
+
+def allocated(func):
+    """Return the peak and total size in bytes allocated by func()."""
+    tracemalloc.start()
+    try:
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=400)
+    parser.add_argument('--pools', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lb = build_loadbalancer(args.pools, args.members)
+    serializer = agent_rpc.DataModelSerializer()
+    plain = lambda: lb.to_dict(stats=False)
+    memoized = lambda: serializer.serialize_message(
+        'update_loadbalancer', {'obj': lb})['obj']
+    assert plain() == memoized()
+
+    for name, func in (('to_dict', plain), ('serialize_message', memoized)):
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        peak, kept = allocated(func)
+        print('%-18s %8.1f ms %8.1f MiB peak %8.1f MiB result' %
+              (name, best * 1000, peak / 2.0 ** 20, kept / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()